@@ -17,7 +17,7 @@
 #
 ##################################################################
 
-import math
+import os, copy, math, mmap, stat, time, struct, inspect, tempfile, threading
 import numpy as np
 from typing import Final
 from scipy import signal
@@ -29,6 +29,102 @@ class ppms_algs(object):
     #  Define the A440 algorithm
     A440 = lambda note: math.pow(2, (note - 69) / 12) * 440
 
+##  Writes files so they are either fully replaced or left as they were.
+#  Data goes to a temporary file in the same folder that is then moved into place.
+class atomic_file(object):
+    ##  Write a file.
+    #  The new file keeps the mode of the file it replaces,
+    #  or the default mode for new files instead of the owner only mode of mkstemp.
+    #  @param filename File to write
+    #  @param data String or bytes to write
+    @staticmethod
+    def write(filename, data):
+        fd, temp_name = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), suffix=".tmp")
+        try:
+            try: os.chmod(temp_name, stat.S_IMODE(os.stat(filename).st_mode))
+            except FileNotFoundError:
+                umask = os.umask(0)
+                os.umask(umask)
+                os.chmod(temp_name, 0o666 & ~umask)
+            with os.fdopen(fd, "wb" if isinstance(data, (bytes, bytearray)) else "w") as out_file:
+                out_file.write(data)
+                out_file.flush()
+                os.fsync(out_file.fileno())
+            os.replace(temp_name, filename)
+        except:
+            os.remove(temp_name)
+            raise
+
+##  Note frequency and pitch bend lookup tables.
+#  Frequencies for all 128 MIDI notes and ratios for every 14-bit
+#  pitch bend value are built once, so per-block setup is a gather.
+class tuning(object):
+    ##  Number of MIDI notes
+    NOTE_COUNT: Final = 128
+    ##  Number of 14-bit pitch bend values
+    BEND_COUNT: Final = 16384
+    ##  Pitch bend value for no bend
+    BEND_CENTER: Final = 8192
+
+    ##  Initialize the tables.
+    #  @param self Object pointer
+    #  @param bend_range Pitch bend range in semitones
+    #  @param tuning_file Optional file of alternate note frequencies
+    def __init__(self, bend_range=2, tuning_file=None):
+        ##  Frequency of each MIDI note
+        self.__note_table = np.array(
+            [ ppms_algs.A440(note) for note in range(self.NOTE_COUNT) ], dtype=np.float64)
+        ##  Frequency ratio of each pitch bend value
+        self.__bend_table = np.ones(self.BEND_COUNT, dtype=np.float64)
+        ##  Range the bend table was built for
+        self.__bend_range = None
+        self.set_bend_range(bend_range)
+        if tuning_file is not None: self.load_tuning(tuning_file)
+
+    ##  Load an alternate tuning.
+    #  The file lists one frequency in Hz per line for notes 0 through 127.
+    #  Blank lines and lines starting with # are skipped.
+    #  @param self Object pointer
+    #  @param filename Tuning file to load
+    def load_tuning(self, filename):
+        freqs = []
+        with open(filename, "r") as tuning_file:
+            for line in tuning_file:
+                line = line.strip()
+                if not line or line.startswith("#"): continue
+                freqs.append(float(line.split()[0]))
+        if len(freqs) != self.NOTE_COUNT:
+            raise ValueError("Tuning file must list " + str(self.NOTE_COUNT) + " frequencies", filename)
+        self.__note_table[:] = freqs
+
+    ##  Set the pitch bend range.
+    #  The bend table is only rebuilt when the range changes.
+    #  @param self Object pointer
+    #  @param bend_range Pitch bend range in semitones
+    def set_bend_range(self, bend_range):
+        if bend_range == self.__bend_range: return
+        #  Map 0..8192..16383 to -1..0..1 and convert to a frequency ratio
+        bend = np.arange(self.BEND_COUNT, dtype=np.float64) - self.BEND_CENTER
+        bend[:self.BEND_CENTER] /= self.BEND_CENTER
+        bend[self.BEND_CENTER:] /= self.BEND_COUNT - 1 - self.BEND_CENTER
+        self.__bend_table[:] = np.exp2(bend * bend_range / 12)
+        self.__bend_range = bend_range
+
+    ##  Get the frequency of a single note.
+    #  @param self Object pointer
+    #  @param note MIDI note number
+    #  @return Note frequency
+    def frequency(self, note):
+        return self.__note_table[note]
+
+    ##  Get the bent frequencies of a group of notes.
+    #  @param self Object pointer
+    #  @param notes Array of MIDI note numbers
+    #  @param pitch_bend 14-bit pitch bend value
+    #  @return Array of note frequencies with pitch bend factored
+    def frequencies(self, notes, pitch_bend):
+        return self.__note_table[notes] * self.__bend_table[pitch_bend]
+
 ##  Generates samples of different waveforms.
 class oscillator(object):
     ##  Initialize and store sample rate.
@@ -47,81 +143,229 @@ class oscillator(object):
         t = ((time_data + np.arange(frame_size)) / self.__sample_rate).reshape(-1, 1)
         return t.reshape(-1, 1)
 
-    ##  Calculate pitch bend.
-    #  @param self Object pointer
-    #  @param note_freq Note frequency
-    #  @param pich_bend Pitch bend amount
-    #  @return The note frequency with pitch bend factored
-    def __calc_pitch_bend(self, note_freq, pitch_bend):
-        if pitch_bend != 0: note_freq = note_freq * pitch_bend
-        return note_freq
-
     ##  Calculate phase shift data for oscillator.
     #  This just cleans up the other function calls a bit.
     #  @param self Object pointer
-    #  @param note Note to play
-    #  @param pitch_bend Pitch bend data
+    #  @param freq Note frequency
     #  @param frame_size Amount of data to generate
     #  @param time_data Position in waveform
     #  @return Generated phase shift data
-    def __OSCFUNC(self, note, pitch_bend, frame_size, time_data):
-        return (2 * np.pi * self.__calc_pitch_bend(ppms_algs.A440(note), pitch_bend)
-            * self.__calc_sample_data(frame_size, time_data))
+    def __OSCFUNC(self, freq, frame_size, time_data):
+        return 2 * np.pi * freq * self.__calc_sample_data(frame_size, time_data)
 
     ##  Return a sawtooth wave sample.
     #  @param self Object pointer
-    #  @param note Note to play
-    #  @param pitch_bend Pitch bend data
+    #  @param freq Note frequency
     #  @param frame_size Amount of data to generate
     #  @param time_data Position in waveform
     #  @return Sawtooth sample
-    def sawtooth(self, note, pitch_bend, frame_size, time_data):
-        return signal.sawtooth(self.__OSCFUNC(note, pitch_bend, frame_size, time_data))
+    def sawtooth(self, freq, frame_size, time_data):
+        return signal.sawtooth(self.__OSCFUNC(freq, frame_size, time_data))
 
     ##  Return a triangle wave sample.
     #  @param self Object pointer
-    #  @param note Note to play
-    #  @param pitch_bend Pitch bend data
+    #  @param freq Note frequency
     #  @param frame_size Amount of data to generate
     #  @param time_data Position in waveform
     #  @return Triangle sample
-    def triangle(self, note, pitch_bend, frame_size, time_data):
-        return signal.sawtooth(self.__OSCFUNC(note, pitch_bend, frame_size, time_data), 0.5)
+    def triangle(self, freq, frame_size, time_data):
+        return signal.sawtooth(self.__OSCFUNC(freq, frame_size, time_data), 0.5)
 
     ##  Return a square wave sample.
     #  @param self Object pointer
-    #  @param note Note to play
-    #  @param pitch_bend Pitch bend data
+    #  @param freq Note frequency
     #  @param frame_size Amount of data to generate
     #  @param time_data Position in waveform
     #  @return Square sample
-    def square(self, note, pitch_bend, frame_size, time_data):
-        return signal.square(self.__OSCFUNC(note, pitch_bend, frame_size, time_data))
+    def square(self, freq, frame_size, time_data):
+        return signal.square(self.__OSCFUNC(freq, frame_size, time_data))
 
     ##  Return a sine wave sample.
     #  @param self Object pointer
-    #  @param note Note to play
-    #  @param pitch_bend Pitch bend data
+    #  @param freq Note frequency
     #  @param frame_size Amount of data to generate
     #  @param time_data Position in waveform
     #  @return Sine sample
-    def sine(self, note, pitch_bend, frame_size, time_data):
-        return np.sin(self.__OSCFUNC(note, pitch_bend, frame_size, time_data))
+    def sine(self, freq, frame_size, time_data):
+        return np.sin(self.__OSCFUNC(freq, frame_size, time_data))
+
+##  Plays multisampled instruments from audio files.
+#  Sample files are memory mapped, so they cost no load time or
+#  memory until a note plays them.
+class sampler(object):
+    ##  WAV format tags
+    __WAV_PCM: Final = 1
+    __WAV_FLOAT: Final = 3
+    __WAV_EXTENSIBLE: Final = 0xFFFE
+
+    ##  Initialize sampler.
+    #  @param self Object pointer
+    #  @param rate Sample rate
+    #  @param tune Tuning tables to find the frequency of root notes
+    def __init__(self, rate, tune):
+        ##  Store the sample rate
+        self.__sample_rate: Final = rate
+        ##  Store the tuning tables
+        self.__tune: Final = tune
+        self.__zones = []
+        self.__note_zones = [ None ] * tuning.NOTE_COUNT
+        self.__positions = dict()
+        self.__ramp = np.zeros(0, dtype=np.float64)
+
+    ##  Load the sample zones.
+    #  Zones have the format low_note, high_note, root_note, filename
+    #  with an optional loop_start and loop_end in sample frames.
+    #  Files ending in .wav are read as WAV files, all others as raw
+    #  float32 at the output sample rate.
+    #  @param self Object pointer
+    #  @param zones List of sample zones
+    def load_zones(self, zones):
+        self.__zones.clear()
+        self.__note_zones = [ None ] * tuning.NOTE_COUNT
+        for zone in zones:
+            data, rate, scale = self.__map_file(zone[3])
+            if len(zone) > 5: loop_start, loop_end = zone[4], min(zone[5], data.shape[0])
+            else: loop_start, loop_end = 0, 0
+            #  data, sample rate, scale, root note, loop start, loop end
+            self.__zones.append([ data, rate, scale, zone[2], loop_start, loop_end ])
+            for note in range(max(zone[0], 0), min(zone[1] + 1, tuning.NOTE_COUNT)):
+                self.__note_zones[note] = self.__zones[-1]
+
+    ##  Memory map a sample file.
+    #  @param self Object pointer
+    #  @param filename File to map
+    #  @return Tuple of the first channel of sample data, its sample rate and scale
+    def __map_file(self, filename):
+        if not filename.lower().endswith(".wav"):
+            return np.memmap(filename, dtype=np.float32, mode="r"), self.__sample_rate, 1.0
+
+        #  Find the format and data chunks of the WAV file
+        fmt = None
+        with open(filename, "rb") as wav_file:
+            riff, _, wave = struct.unpack("<4sI4s", wav_file.read(12))
+            if riff != b"RIFF" or wave != b"WAVE": raise ValueError("Not a WAV file", filename)
+            while True:
+                header = wav_file.read(8)
+                if len(header) < 8: raise ValueError("No data in WAV file", filename)
+                chunk_id, chunk_size = struct.unpack("<4sI", header)
+                if chunk_id == b"fmt ":
+                    fmt = wav_file.read(chunk_size)
+                    if chunk_size % 2: wav_file.seek(1, os.SEEK_CUR)
+                elif chunk_id == b"data":
+                    offset = wav_file.tell()
+                    break
+                else: wav_file.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+        if fmt is None: raise ValueError("No format in WAV file", filename)
+
+        format_tag, channels, rate, _, _, bits = struct.unpack_from("<HHIIHH", fmt)
+        #  Extensible format stores the real format at the start of the sub format
+        if format_tag == self.__WAV_EXTENSIBLE: format_tag, = struct.unpack_from("<H", fmt, 24)
+        if format_tag == self.__WAV_FLOAT and bits == 32: dtype, scale = np.float32, 1.0
+        elif format_tag == self.__WAV_PCM and bits == 16: dtype, scale = np.int16, 1 / 32768
+        elif format_tag == self.__WAV_PCM and bits == 32: dtype, scale = np.int32, 1 / 2147483648
+        else: raise ValueError("Unsupported WAV format", filename)
+
+        frames = chunk_size // (channels * np.dtype(dtype).itemsize)
+        data = np.memmap(filename, dtype=dtype, mode="r", offset=offset, shape=(frames, channels))
+        return data[:, 0], rate, scale
+
+    ##  Start playing a sample from the beginning.
+    #  @param self Object pointer
+    #  @param voice Key of the voice playing the sample
+    def trigger(self, voice):
+        self.__positions[voice] = 0.0
+
+    ##  Stop playing a sample.
+    #  @param self Object pointer
+    #  @param voice Key of the voice playing the sample
+    def release(self, voice):
+        self.__positions.pop(voice, None)
+
+    ##  Check if a voice still has sample data to play.
+    #  Looping samples play until released.
+    #  @param self Object pointer
+    #  @param voice Key of the voice playing the sample
+    #  @param note Note being played
+    #  @return True if still playing, else false
+    def is_playing(self, voice, note):
+        zone = self.__note_zones[note]
+        if zone is None or voice not in self.__positions: return False
+        if zone[5] > zone[4]: return True
+        return self.__positions[voice] < zone[0].shape[0] - 1
+
+    ##  Return a block of sample data.
+    #  The sample is resampled from its root note to the note frequency.
+    #  @param self Object pointer
+    #  @param voice Key of the voice playing the sample
+    #  @param note Note being played
+    #  @param freq Note frequency
+    #  @param frame_size Amount of data to generate
+    #  @return Sample data
+    def play(self, voice, note, freq, frame_size):
+        zone = self.__note_zones[note]
+        if zone is None or zone[0].shape[0] < 2:
+            return np.zeros(shape=(frame_size,1), dtype=np.float32)
+        data, rate, scale, root, loop_start, loop_end = zone
+        if self.__ramp.shape[0] != frame_size: self.__ramp = np.arange(frame_size, dtype=np.float64)
+
+        #  Position of each output frame in the sample
+        step = freq / self.__tune.frequency(root) * rate / self.__sample_rate
+        position = self.__positions.get(voice, 0.0)
+        index = position + step * self.__ramp
+        position += step * frame_size
+        looping = loop_end > loop_start
+        if looping:
+            loop_length = loop_end - loop_start
+            index = np.where(index >= loop_end, loop_start + (index - loop_start) % loop_length, index)
+            if position >= loop_end: position = loop_start + (position - loop_start) % loop_length
+        self.__positions[voice] = position
+
+        #  Linear interpolation between neighbouring frames
+        last = data.shape[0] - 1
+        valid = index < last
+        first = np.minimum(index.astype(np.intp), last - 1)
+        frac = index - first
+        second = first + 1
+        if looping: second = np.where(second >= loop_end, loop_start, second)
+        out = (data[first] * (1 - frac) + data[second] * frac) * scale
+        if not looping: out[~valid] = 0
+        return out.reshape(-1, 1)
 
 ##  Creates "patches" of "synth modules" to process the signal.
 #  The main ppms application sets this up from its configuration file.
+#  Modules are created as objects with their own state.  Each playing note
+#  holds a voice slot, and modules keep their state in arrays indexed by it.
 class patchboard(object):
     ##  Initialize patchboard.
     #  @param self Object pointer
-    def __init__(self):
+    #  @param voices Number of voice slots modules keep state for
+    def __init__(self, voices=32):
+        self.__voices: Final = voices
         self.__patches = list()
+        self.__profiler = None
+
+    ##  Get the number of voice slots.
+    #  @param self Object pointer
+    #  @return Number of voice slots
+    def get_voices(self):
+        return self.__voices
+
+    ##  Time each module with a profiler.
+    #  @param self Object pointer
+    #  @param prof Profiler to use, or None to stop profiling
+    def set_profiler(self, prof):
+        self.__profiler = prof
 
     ##  Add a module to the patchboard.
     #  These will be processed in order loaded.
+    #  Voice modules are created with state for each voice slot,
+    #  other modules are wrapped in an adapter.
     #  @param self Object pointer
-    #  @param mod Synth module to add
+    #  @param mod Synth module class to add
     def add_module(self, mod):
-        try: self.__patches.append(mod)
+        try:
+            if mod.PER_VOICE: self.__patches.append(mod(self.__voices))
+            else: self.__patches.append(module_adapter(mod))
         except: raise RuntimeError("Error adding module to patchboard")
 
     ##  Clear all loaded modules.
@@ -135,35 +379,80 @@ class patchboard(object):
     #  @return Module object if found, else raise not found exception
     def get_module(self, name):
         for module in self.__patches:
-            if(name == module.__name__): return module
+            if(name == module.get_name()): return module
         raise IndexError("Module not found")
 
+    ##  Set a module control.
+    #  @param self Object pointer
+    #  @param binding Binding name in the format class_name.member_name
+    #  @param value New value to set
+    def set_control(self, binding, value):
+        mod = binding.split(".", 1)
+        self.get_module(mod[0]).set_control(mod[1], value)
+
+    ##  Reset module state for a voice slot when a new note starts.
+    #  @param self Object pointer
+    #  @param voice Voice slot to reset
+    def start_voice(self, voice):
+        for module in self.__patches:
+            module.start_voice(voice)
+
+    ##  Check if any module is still producing a tail for a note.
+    #  @param self Object pointer
+    #  @param voice Voice slot playing the note
+    #  @param note Note to check
+    #  @return True if a module has a tail, else false
+    def tail_active(self, voice, note):
+        for module in self.__patches:
+            if module.voice_tail_active(voice, note): return True
+        return False
+
     ##  Save all module data.
     #  @param self Object pointer
     #  @return List of all module save data
     def save_data(self):
         data = []
         for module in self.__patches:
-            try: data += module.save_data(module)
+            try: data += module.save_data()
             except: pass
         return data
 
-    ##  Process modules in order.
+    ##  Process modules in order for a bank of voices.
+    #  @param self Object pointer
+    #  @param voices Array of voice slots being played
+    #  @param notes Notes played by each voice
+    #  @param signals Signal data to modify, one row for each voice
+    #  @return Modified signal data
+    def patch(self, voices, notes, signals):
+        if self.__profiler is not None: return self.__profile_patch(voices, notes, signals)
+        for module in self.__patches:
+            try: signals = module.process_voices(voices, notes, signals)
+            except NotImplementedError as e: raise
+            except: pass
+        return signals
+
+    ##  Process modules in order while timing each one.
     #  @param self Object pointer
-    #  @param signal Signal data to modify
+    #  @param voices Array of voice slots being played
+    #  @param notes Notes played by each voice
+    #  @param signals Signal data to modify, one row for each voice
     #  @return Modified signal data
-    def patch(self, note, signal):
+    def __profile_patch(self, voices, notes, signals):
         for module in self.__patches:
-            try: signal = module.process(module, note, signal)
+            start = self.__profiler.mark()
+            try: signals = module.process_voices(voices, notes, signals)
             except NotImplementedError as e: raise
             except: pass
-        return signal
+            self.__profiler.add(start, "patchboard", module.get_name())
+        return signals
 
 ##  Synth module base class.
 #  Extend this object to create a usable synth module.
 class synthmod(metaclass=ABCMeta):
     ##  Flag to check if valid synth module
     IS_SYNTHMOD: Final = True
+    ##  Flag for modules created with state for each voice
+    PER_VOICE = False
     ##  Midi control minimum value
     MIDI_MIN: Final = 0
     ##  Midi control maximum value
@@ -179,12 +468,169 @@ class synthmod(metaclass=ABCMeta):
     def process(self, note, signal):
         raise NotImplementedError("Must override process method in synth module", self.__name__)
 
+    ##  Check if the module is still producing sound for a released note.
+    #  Override this in modules that keep state, such as delays.
+    #  Released notes are removed once no module has a tail.
+    #  @param self Object pointer
+    #  @param note Note to check
+    #  @return True if the module has a tail, else false
+    def tail_active(self, note):
+        return False
+
+##  Synth module base class with state for each voice.
+#  Extend this object to create a module that is created by the patchboard
+#  and keeps filter memory, envelope stages or delay lines for each voice slot.
+#  State should be allocated in init_voices as arrays indexed by voice slot,
+#  so process_voices can work on all playing voices at once.
+class voice_synthmod(synthmod):
+    ##  Flag for modules created with state for each voice
+    PER_VOICE = True
+
+    ##  Initialize voice module.
+    #  @param self Object pointer
+    #  @param voices Number of voice slots to keep state for
+    def __init__(self, voices):
+        self.voices = voices
+        self.init_voices(voices)
+
+    ##  Get the module name used in bindings.
+    #  @param self Object pointer
+    #  @return Module class name
+    def get_name(self):
+        return type(self).__name__
+
+    ##  Allocate state for all voice slots.
+    #  Override this in modules that keep state.
+    #  @param self Object pointer
+    #  @param voices Number of voice slots
+    def init_voices(self, voices):
+        pass
+
+    ##  Reset state for a voice slot when a new note starts.
+    #  Override this in modules that keep state.
+    #  @param self Object pointer
+    #  @param voice Voice slot to reset
+    def start_voice(self, voice):
+        pass
+
+    ##  Process a bank of voices.
+    #  Override this to implement the module.
+    #  Raises not implemented error if not overridden.
+    #  @param self Object pointer
+    #  @param voices Array of voice slots being played
+    #  @param notes Notes played by each voice
+    #  @param signals Signal data to modify, one row for each voice
+    #  @return Modified signal data
+    @abstractmethod
+    def process_voices(self, voices, notes, signals):
+        raise NotImplementedError("Must override process_voices method in synth module", self.get_name())
+
+    ##  Process a single signal using the first voice slot.
+    #  @param self Object pointer
+    #  @param note Note to be played
+    #  @param signal Audio signal
+    #  @return Modified signal data
+    def process(self, note, signal):
+        return self.process_voices(np.zeros(1, dtype=np.intp), [ note ], signal[np.newaxis])[0]
+
+    ##  Check if the module is still producing sound for a released voice.
+    #  Override this in modules that keep state, such as delays.
+    #  @param self Object pointer
+    #  @param voice Voice slot playing the note
+    #  @param note Note to check
+    #  @return True if the module has a tail, else false
+    def voice_tail_active(self, voice, note):
+        return False
+
+    ##  Set a module control.
+    #  @param self Object pointer
+    #  @param member Name of the control member
+    #  @param value New value to set
+    def set_control(self, member, value):
+        getattr(self, member)(value)
+
+##  Adapter for class based synth modules.
+#  These keep their parameters as class attributes and are called on the class,
+#  so all voices share one state.  The adapter gives them the voice module interface.
+#  Each adapter works on its own copy of the class, so a module loaded on more
+#  than one patchboard keeps separate settings for each.
+class module_adapter(object):
+    ##  Initialize adapter.
+    #  @param self Object pointer
+    #  @param module Synth module class to wrap
+    def __init__(self, module):
+        self.__module: Final = self.__copy_class(module)
+
+    ##  Copy a module class along with its class attributes.
+    #  Functions are shared, data such as arrays is copied.
+    #  @param module Synth module class to copy
+    #  @return New class with the same name
+    @staticmethod
+    def __copy_class(module):
+        namespace = dict()
+        for key, value in module.__dict__.items():
+            #  These are made again for the new class
+            if key in ('__dict__', '__weakref__', '__abstractmethods__', '_abc_impl'): continue
+            if(inspect.isroutine(value) or isinstance(value, (staticmethod, classmethod, property))
+            or (key.startswith('__') and key.endswith('__'))):
+                namespace[key] = value
+            else: namespace[key] = copy.deepcopy(value)
+        return type(module)(module.__name__, module.__bases__, namespace)
+
+    ##  Get the module name used in bindings.
+    #  @param self Object pointer
+    #  @return Module class name
+    def get_name(self):
+        return self.__module.__name__
+
+    ##  Class based modules have no voice state to reset.
+    #  @param self Object pointer
+    #  @param voice Voice slot to reset
+    def start_voice(self, voice):
+        pass
+
+    ##  Process each voice through the class based module.
+    #  @param self Object pointer
+    #  @param voices Array of voice slots being played
+    #  @param notes Notes played by each voice
+    #  @param signals Signal data to modify, one row for each voice
+    #  @return Modified signal data
+    def process_voices(self, voices, notes, signals):
+        for idx, note in enumerate(notes):
+            try: signals[idx] = self.__module.process(self.__module, note, signals[idx])
+            except NotImplementedError as e: raise
+            except: pass
+        return signals
+
+    ##  Check if the module is still producing sound for a released note.
+    #  @param self Object pointer
+    #  @param voice Voice slot playing the note
+    #  @param note Note to check
+    #  @return True if the module has a tail, else false
+    def voice_tail_active(self, voice, note):
+        return self.__module.tail_active(self.__module, note)
+
+    ##  Set a module control.
+    #  @param self Object pointer
+    #  @param member Name of the control member
+    #  @param value New value to set
+    def set_control(self, member, value):
+        getattr(self.__module, member)(self.__module, value)
+
+    ##  Build an array of save data for the module.
+    #  @param self Object pointer
+    #  @return Module data to save
+    def save_data(self):
+        return self.__module.save_data(self.__module)
+
 ##  Mod wheel control part.
 #  Lets a synth module read in the mod wheel value.
 #  Extend this and call self.get_mod_value() to read.
 class mod_control(metaclass=ABCMeta):
     ##  Store the mod wheel value.
     __MOD_VALUE = 0
+    ##  Store the modulation source signals.
+    __MOD_SIGNALS = dict()
 
     ##  Set the mod wheel value.
     #  This is set within the ppms input coroutine.
@@ -201,3 +647,939 @@ class mod_control(metaclass=ABCMeta):
     @classmethod
     def get_mod_value(cls):
         return cls.__MOD_VALUE
+
+    ##  Set a modulation source signal.
+    #  This is set by the modulator once per block.
+    #  @param cls Object pointer
+    #  @param name Name of the modulation source
+    #  @param signal Control signal for the current block
+    @classmethod
+    def set_mod_signal(cls, name, signal):
+        cls.__MOD_SIGNALS[name] = signal
+
+    ##  Get a modulation source signal.
+    #  Called within a synth module.
+    #  @param cls Object pointer
+    #  @param name Name of the modulation source
+    #  @return Control signal for the current block, or None if not found
+    @classmethod
+    def get_mod_signal(cls, name):
+        return cls.__MOD_SIGNALS.get(name)
+
+##  Generates modulation signals from LFOs and envelope followers.
+#  Each source is calculated once per block and shared by every module.
+#  The modulation matrix routes sources to module controls or the mod wheel.
+class modulator(object):
+    ##  Routing destination for the mod wheel
+    MOD_WHEEL: Final = "mod_wheel"
+
+    ##  Initialize modulator.
+    #  @param self Object pointer
+    #  @param rate Sample rate
+    def __init__(self, rate):
+        ##  Store the sample rate
+        self.__sample_rate: Final = rate
+        self.__lfos = []
+        self.__followers = []
+        self.__routes = []
+        self.__ramp = np.zeros(shape=(0,1), dtype=np.float64)
+
+    ##  Load the modulation sources and matrix.
+    #  Sources have the format name, 'lfo', waveform, rate in Hz
+    #  or name, 'follower', attack in ms, release in ms.
+    #  Routes have the format source, destination, depth, offset.
+    #  @param self Object pointer
+    #  @param sources List of modulation sources
+    #  @param routes List of modulation routes
+    def load(self, sources, routes):
+        self.__lfos.clear()
+        self.__followers.clear()
+        for source in sources:
+            if source[1] == "lfo":
+                if source[2] not in ( "sine", "triangle", "sawtooth", "square" ):
+                    raise ValueError("Unknown LFO waveform", source[2])
+                #  name, waveform, radians per sample, phase
+                self.__lfos.append([ source[0], source[2], 2 * np.pi * source[3] / self.__sample_rate, 0.0 ])
+            elif source[1] == "follower":
+                #  name, attack time, release time, level, target level
+                self.__followers.append([ source[0], source[2] / 1000, source[3] / 1000, 0.0, 0.0 ])
+            else: raise ValueError("Unknown modulation source", source[1])
+        #  source, destination, depth, offset, last value set
+        self.__routes = [ [ route[0], route[1], route[2], route[3], None ] for route in routes ]
+
+    ##  Calculate all source signals for the next block.
+    #  @param self Object pointer
+    #  @param frame_size Size of the block
+    def process(self, frame_size):
+        if self.__ramp.shape[0] != frame_size:
+            self.__ramp = np.arange(frame_size, dtype=np.float64).reshape(-1, 1)
+
+        for lfo in self.__lfos:
+            phase = lfo[3] + lfo[2] * self.__ramp
+            if lfo[1] == "sine": lfo_signal = np.sin(phase)
+            elif lfo[1] == "triangle": lfo_signal = signal.sawtooth(phase, 0.5)
+            elif lfo[1] == "sawtooth": lfo_signal = signal.sawtooth(phase)
+            else: lfo_signal = signal.square(phase)
+            mod_control.set_mod_signal(lfo[0], lfo_signal)
+            lfo[3] = (lfo[3] + lfo[2] * frame_size) % (2 * np.pi)
+
+        for follower in self.__followers:
+            #  Ramp from the current level to the level of the last block
+            level = follower[3]
+            target = follower[4]
+            if target > level: time = follower[1]
+            else: time = follower[2]
+            if time > 0: coef = math.exp(-frame_size / (self.__sample_rate * time))
+            else: coef = 0.0
+            follower[3] = target + (level - target) * coef
+            mod_control.set_mod_signal(follower[0],
+                level + (follower[3] - level) * (self.__ramp + 1) / frame_size)
+
+    ##  Advance all sources past a block without calculating signals.
+    #  Used when the block is silent.
+    #  @param self Object pointer
+    #  @param frame_size Size of the block
+    def skip(self, frame_size):
+        for lfo in self.__lfos:
+            lfo[3] = (lfo[3] + lfo[2] * frame_size) % (2 * np.pi)
+        for follower in self.__followers:
+            #  Release towards silence
+            follower[4] = 0.0
+            if follower[2] > 0: follower[3] *= math.exp(-frame_size / (self.__sample_rate * follower[2]))
+            else: follower[3] = 0.0
+
+    ##  Feed the last output block to the envelope followers.
+    #  @param self Object pointer
+    #  @param block Output block
+    def follow(self, block):
+        if not self.__followers: return
+        level = math.sqrt(np.mean(np.square(block)))
+        for follower in self.__followers: follower[4] = level
+
+    ##  Apply the modulation matrix.
+    #  Controls are only set when their value changes.
+    #  @param self Object pointer
+    #  @param boards List of patchboards to set module controls on
+    def apply(self, boards):
+        for route in self.__routes:
+            mod_signal = mod_control.get_mod_signal(route[0])
+            if mod_signal is None: continue
+            value = int(round(route[3] + route[2] * float(np.mean(mod_signal))))
+            value = min(max(value, synthmod.MIDI_MIN), synthmod.MIDI_MAX)
+            if value == route[4]: continue
+            route[4] = value
+            if route[1] == self.MOD_WHEEL: mod_control.set_mod_value(value)
+            else:
+                for patches in boards:
+                    try: patches.set_control(route[1], value)
+                    except: pass  #  If binding not found, do nothing
+
+##  Records the output signal to a WAV or raw float32 file.
+#  The audio thread only copies blocks into a preallocated ring buffer.
+#  A writer thread drains the ring to disk, so a slow disk drops
+#  recorded blocks instead of stalling the audio output.
+class recorder(object):
+    ##  WAV format tag for 32-bit float samples
+    __WAV_FLOAT: Final = 3
+    ##  Size of the WAV header in bytes
+    __WAV_HEADER_SIZE: Final = 44
+    ##  Bytes per sample
+    __SAMPLE_SIZE: Final = 4
+    ##  How often the writer thread drains the ring in seconds
+    __DRAIN_TIME: Final = 0.05
+
+    ##  Initialize the recorder and allocate the ring buffer.
+    #  @param self Object pointer
+    #  @param rate Sample rate
+    #  @param channels Number of channels in each block
+    #  @param buffer_seconds Length of the ring buffer in seconds
+    #  @param use_mmap Write through a memory mapped file
+    #  @param mmap_seconds Amount to grow the memory mapped file by in seconds
+    def __init__(self, rate, channels=1, buffer_seconds=10, use_mmap=False, mmap_seconds=60):
+        ##  Store the sample rate
+        self.__sample_rate: Final = int(rate)
+        ##  Store the channel count
+        self.__channels: Final = channels
+        ##  Ring buffer shared by the audio and writer threads
+        self.__ring: Final = np.zeros(shape=(int(rate * buffer_seconds), channels), dtype=np.float32)
+        ##  Write through a memory mapped file
+        self.__use_mmap: Final = use_mmap
+        ##  Frames the memory mapped file grows by
+        self.__mmap_frames: Final = int(rate * mmap_seconds)
+        #  Ring positions only ever increase
+        #  The audio thread owns write_pos, the writer thread owns read_pos
+        self.__write_pos = 0
+        self.__read_pos = 0
+        self.__dropped = 0
+        self.__active = False
+        self.__filename = None
+        self.__wav = False
+        self.__file = None
+        self.__map = None
+        self.__frames = 0
+        self.__thread = None
+        self.__stop_event = threading.Event()
+
+    ##  Check if recording.
+    #  @param self Object pointer
+    #  @return True if recording, else false
+    def is_recording(self):
+        return self.__active
+
+    ##  Check if the writer thread is still finishing a stopped recording.
+    #  @param self Object pointer
+    #  @return True if still saving, else false
+    def is_saving(self):
+        return not self.__active and self.__thread is not None and self.__thread.is_alive()
+
+    ##  Get the number of frames dropped because the ring was full.
+    #  @param self Object pointer
+    #  @return Dropped frame count
+    def get_dropped(self):
+        return self.__dropped
+
+    ##  Copy an output block into the ring buffer.
+    #  Called from the audio thread.  Never blocks or touches the disk.
+    #  @param self Object pointer
+    #  @param block Block of output samples
+    def tap(self, block):
+        if not self.__active: return
+        frames = block.shape[0]
+        size = self.__ring.shape[0]
+        #  Drop the block if the writer has fallen behind
+        if frames > size - (self.__write_pos - self.__read_pos):
+            self.__dropped += frames
+            return
+        start = self.__write_pos % size
+        end = start + frames
+        if end <= size: self.__ring[start:end] = block
+        else:
+            split = size - start
+            self.__ring[start:] = block[:split]
+            self.__ring[:end - size] = block[split:]
+        self.__write_pos += frames
+
+    ##  Start recording to a file.
+    #  Files ending in .wav are written as WAV, all others as raw float32.
+    #  Can't start until the last recording has finished saving.
+    #  @param self Object pointer
+    #  @param filename File to record to
+    #  @return True if recording was started, else false
+    def start(self, filename):
+        if self.__active or self.is_saving(): return False
+        self.__filename = filename
+        self.__wav = filename.lower().endswith(".wav")
+        self.__frames = 0
+        self.__dropped = 0
+        self.__write_pos = 0
+        self.__read_pos = 0
+        self.__open_sink()
+        self.__stop_event.clear()
+        self.__thread = threading.Thread(target=self.__writer, daemon=True)
+        self.__thread.start()
+        self.__active = True
+        return True
+
+    ##  Stop recording.
+    #  Returns right away, the writer thread finishes the file on its own.
+    #  @param self Object pointer
+    #  @return Name of the recorded file, or None if not recording
+    def stop(self):
+        if not self.__active: return None
+        self.__active = False
+        self.__stop_event.set()
+        return self.__filename
+
+    ##  Wait for the writer thread to finish saving.
+    #  @param self Object pointer
+    def wait(self):
+        if self.__thread is not None: self.__thread.join()
+
+    ##  Writer thread.  Drains the ring until stopped.
+    #  @param self Object pointer
+    def __writer(self):
+        while not self.__stop_event.wait(self.__DRAIN_TIME):
+            self.__drain()
+        self.__drain()
+        self.__close_sink()
+
+    ##  Write everything waiting in the ring to the sink.
+    #  @param self Object pointer
+    def __drain(self):
+        size = self.__ring.shape[0]
+        available = self.__write_pos - self.__read_pos
+        if available <= 0: return
+        start = self.__read_pos % size
+        end = start + available
+        if end <= size: self.__write_sink(self.__ring[start:end])
+        else:
+            self.__write_sink(self.__ring[start:])
+            self.__write_sink(self.__ring[:end - size])
+        self.__read_pos += available
+
+    ##  Build a WAV header.
+    #  @param self Object pointer
+    #  @param frames Number of frames in the file
+    #  @return Header bytes
+    def __wav_header(self, frames):
+        block_align = self.__channels * self.__SAMPLE_SIZE
+        data_size = min(frames * block_align, 0xFFFFFFFF - 36)
+        return struct.pack("<4sI4s4sIHHIIHH4sI",
+            b"RIFF", 36 + data_size, b"WAVE",
+            b"fmt ", 16, self.__WAV_FLOAT, self.__channels,
+            self.__sample_rate, self.__sample_rate * block_align, block_align, 32,
+            b"data", data_size)
+
+    ##  Get the size of the header for the current file.
+    #  @param self Object pointer
+    #  @return Header size in bytes
+    def __header_size(self):
+        if self.__wav: return self.__WAV_HEADER_SIZE
+        return 0
+
+    ##  Open the file to record to.
+    #  @param self Object pointer
+    def __open_sink(self):
+        self.__file = open(self.__filename, "w+b", buffering=1 << 20)
+        if self.__wav: self.__file.write(self.__wav_header(0))
+        if self.__use_mmap: self.__map_sink(self.__mmap_frames)
+
+    ##  Map the file into memory with room for a number of frames.
+    #  @param self Object pointer
+    #  @param frames Number of frames to make room for
+    def __map_sink(self, frames):
+        self.__file.flush()
+        self.__file.truncate(self.__header_size() + frames * self.__channels * self.__SAMPLE_SIZE)
+        self.__map = np.memmap(self.__file, dtype=np.float32, mode="r+",
+            offset=self.__header_size(), shape=(frames, self.__channels))
+
+    ##  Write a run of frames to the file.
+    #  @param self Object pointer
+    #  @param data Frames to write
+    def __write_sink(self, data):
+        frames = data.shape[0]
+        if self.__map is not None:
+            #  Grow the mapping if this write runs past its end
+            if self.__frames + frames > self.__map.shape[0]:
+                size = self.__map.shape[0] + max(frames, self.__mmap_frames)
+                self.__map.flush()
+                self.__map = None
+                self.__map_sink(size)
+            self.__map[self.__frames:self.__frames + frames] = data
+        else: self.__file.write(memoryview(data))
+        self.__frames += frames
+
+    ##  Finish and close the file.
+    #  @param self Object pointer
+    def __close_sink(self):
+        if self.__map is not None:
+            self.__map.flush()
+            self.__map = None
+            #  Trim the unused part of the mapping
+            self.__file.truncate(self.__header_size() + self.__frames * self.__channels * self.__SAMPLE_SIZE)
+        if self.__wav:
+            self.__file.seek(0)
+            self.__file.write(self.__wav_header(self.__frames))
+        self.__file.close()
+        self.__file = None
+
+##  Binary bank of module presets.
+#  All presets are stored in one indexed file that is memory mapped,
+#  so loading a preset is a single lookup by program number.
+class preset_bank(object):
+    ##  File signature
+    __MAGIC: Final = b"PPMSBANK"
+    ##  File format version
+    __VERSION: Final = 2
+    ##  Header layout:  magic, version, preset count
+    __HEADER: Final = struct.Struct("<8sII")
+    ##  Index entry layout:  record offset, record length
+    __INDEX: Final = struct.Struct("<QQ")
+    ##  Length prefix for strings and entry counts
+    __COUNT: Final = struct.Struct("<H")
+    ##  Integer value layout
+    __INT: Final = struct.Struct("<cq")
+    ##  Float value layout
+    __FLOAT: Final = struct.Struct("<cd")
+    ##  Boolean value layout
+    __BOOL: Final = struct.Struct("<c?")
+    ##  Type tag of string and null values
+    __TAG: Final = struct.Struct("<c")
+
+    ##  Initialize the bank.
+    #  @param self Object pointer
+    def __init__(self):
+        self.__file = None
+        self.__map = None
+        self.__count = 0
+
+    ##  Open a bank file.
+    #  Raises IOError if it can't be opened or ValueError if it isn't a bank.
+    #  @param self Object pointer
+    #  @param filename Bank file to open
+    def open(self, filename):
+        self.close()
+        bank_file = open(filename, "rb")
+        try:
+            bank_map = mmap.mmap(bank_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            bank_file.close()
+            raise ValueError("Preset bank is empty", filename)
+        magic, version, count = self.__HEADER.unpack_from(bank_map, 0)
+        if magic != self.__MAGIC or version != self.__VERSION:
+            bank_map.close()
+            bank_file.close()
+            raise ValueError("Not a preset bank", filename)
+        self.__file, self.__map, self.__count = bank_file, bank_map, count
+
+    ##  Close the bank file.
+    #  @param self Object pointer
+    def close(self):
+        if self.__map is not None: self.__map.close()
+        if self.__file is not None: self.__file.close()
+        self.__file, self.__map, self.__count = None, None, 0
+
+    ##  Check if a bank is open.
+    #  @param self Object pointer
+    #  @return True if open, else false
+    def is_open(self):
+        return self.__map is not None
+
+    ##  Get the number of presets in the bank.
+    #  @param self Object pointer
+    #  @return Preset count
+    def count(self):
+        return self.__count
+
+    ##  Get a preset.
+    #  @param self Object pointer
+    #  @param index Preset number
+    #  @return Tuple of preset name and module data
+    def get(self, index):
+        if index < 0 or index >= self.__count: raise IndexError("Preset not found")
+        offset, _ = self.__INDEX.unpack_from(self.__map, self.__HEADER.size + index * self.__INDEX.size)
+        name, offset = self.__read_string(offset)
+        count, = self.__COUNT.unpack_from(self.__map, offset)
+        offset += self.__COUNT.size
+        module_data = []
+        for _ in range(count):
+            binding, offset = self.__read_string(offset)
+            tag = self.__map[offset:offset + 1]
+            if tag == b"i":
+                _, value = self.__INT.unpack_from(self.__map, offset)
+                offset += self.__INT.size
+            elif tag == b"d":
+                _, value = self.__FLOAT.unpack_from(self.__map, offset)
+                offset += self.__FLOAT.size
+            elif tag == b"b":
+                _, value = self.__BOOL.unpack_from(self.__map, offset)
+                offset += self.__BOOL.size
+            elif tag == b"s": value, offset = self.__read_string(offset + self.__TAG.size)
+            elif tag == b"n":
+                value = None
+                offset += self.__TAG.size
+            else: raise ValueError("Unknown value type in preset bank", tag)
+            module_data.append([ binding, value ])
+        return name, module_data
+
+    ##  Read a length prefixed string from the bank.
+    #  @param self Object pointer
+    #  @param offset Position of the string
+    #  @return Tuple of the string and the position after it
+    def __read_string(self, offset):
+        length, = self.__COUNT.unpack_from(self.__map, offset)
+        offset += self.__COUNT.size
+        return str(self.__map[offset:offset + length], "utf-8"), offset + length
+
+    ##  Write a bank file.
+    #  The file is fully replaced or left as it was.
+    #  Values can be int, float, bool, string or None.
+    #  Raises ValueError naming the preset if one can't be stored.
+    #  @param cls Class pointer
+    #  @param filename Bank file to write
+    #  @param presets List of preset name and module data pairs
+    @classmethod
+    def build(cls, filename, presets):
+        records = []
+        for name, module_data in presets:
+            try:
+                record = bytearray(cls.__pack_string(name))
+                record += cls.__COUNT.pack(len(module_data))
+                for binding, value in module_data:
+                    record += cls.__pack_string(binding) + cls.__pack_value(value)
+            except (struct.error, TypeError, ValueError) as e:
+                raise ValueError(f"Can't store preset {name}: {e}")
+            records.append(record)
+
+        data = bytearray(cls.__HEADER.pack(cls.__MAGIC, cls.__VERSION, len(records)))
+        offset = cls.__HEADER.size + len(records) * cls.__INDEX.size
+        for record in records:
+            data += cls.__INDEX.pack(offset, len(record))
+            offset += len(record)
+        for record in records: data += record
+        atomic_file.write(filename, data)
+
+    ##  Pack a length prefixed string.
+    #  @param cls Class pointer
+    #  @param string String to pack
+    #  @return Packed bytes
+    @classmethod
+    def __pack_string(cls, string):
+        data = string.encode("utf-8")
+        return cls.__COUNT.pack(len(data)) + data
+
+    ##  Pack a value with its type tag.
+    #  @param cls Class pointer
+    #  @param value Value to pack
+    #  @return Packed bytes
+    @classmethod
+    def __pack_value(cls, value):
+        #  Check bool first, it's also an int
+        if isinstance(value, bool): return cls.__BOOL.pack(b"b", value)
+        if isinstance(value, int): return cls.__INT.pack(b"i", value)
+        if isinstance(value, float): return cls.__FLOAT.pack(b"d", value)
+        if isinstance(value, str): return cls.__TAG.pack(b"s") + cls.__pack_string(value)
+        if value is None: return cls.__TAG.pack(b"n")
+        raise ValueError(f"unsupported value {value!r}")
+
+##  Times the stages of the audio pipeline.
+#  Time is summed for each stack of stage names and written out
+#  as folded stacks that flamegraph tools can read.
+class profiler(object):
+    ##  Name of the stage all others are timed within
+    ROOT: Final = "audio_callback"
+
+    ##  Initialize the profiler.
+    #  @param self Object pointer
+    #  @param enabled Collect timings, otherwise calls do nothing
+    def __init__(self, enabled=True):
+        ##  Store if enabled
+        self.__enabled: Final = enabled
+        self.__stacks = dict()
+
+    ##  Check if the profiler is collecting timings.
+    #  @param self Object pointer
+    #  @return True if enabled, else false
+    def is_enabled(self):
+        return self.__enabled
+
+    ##  Get a start time for a stage.
+    #  @param self Object pointer
+    #  @return Start time in nanoseconds
+    def mark(self):
+        if not self.__enabled: return 0
+        return time.perf_counter_ns()
+
+    ##  Add the time since a mark to a stage.
+    #  Call with no stage names to time the root stage.
+    #  @param self Object pointer
+    #  @param start Start time from mark
+    #  @param stack Stage names below the root
+    def add(self, start, *stack):
+        if not self.__enabled: return
+        elapsed = time.perf_counter_ns() - start
+        stack = ( self.ROOT, ) + stack
+        self.__stacks[stack] = self.__stacks.get(stack, 0) + elapsed
+
+    ##  Write the timings as folded stacks.
+    #  Each line is a stack followed by its own time in microseconds.
+    #  @param self Object pointer
+    #  @param filename File to write
+    def write(self, filename):
+        #  Stages were timed including their children, so remove child time
+        #  from the closest stage above that was timed
+        self_time = dict(self.__stacks)
+        for stack, elapsed in self.__stacks.items():
+            for depth in range(len(stack) - 1, 0, -1):
+                if stack[:depth] in self_time:
+                    self_time[stack[:depth]] -= elapsed
+                    break
+        with open(filename, "w") as folded_file:
+            for stack, elapsed in sorted(self_time.items()):
+                folded_file.write(";".join(stack) + " " + str(max(elapsed, 0) // 1000) + "\n")
+
+##  Picks the audio block size and latency from the cost of the audio callback.
+#  The block size is chosen once at startup.  With adaptive latency on,
+#  blocks of latency are added under sustained load and removed when idle.
+class block_tuner(object):
+    ##  Block sizes to try, smallest first
+    BLOCK_SIZES: Final = ( 64, 128, 256, 512, 1024, 2048 )
+    ##  Block size assumed when the device picks its own
+    DEFAULT_BLOCKSIZE: Final = 256
+    ##  Largest share of a block's time the callback may use at startup
+    __SAFE_LOAD: Final = 0.5
+    ##  Load that counts as busy
+    __HIGH_LOAD: Final = 0.7
+    ##  Load that counts as idle
+    __LOW_LOAD: Final = 0.3
+    ##  Seconds of busy blocks before adding latency
+    __RAISE_TIME: Final = 2.0
+    ##  Seconds of idle blocks before removing latency
+    __LOWER_TIME: Final = 10.0
+    ##  Smoothing for the load average
+    __LOAD_SMOOTHING: Final = 0.1
+    ##  Fewest blocks of latency
+    MIN_AHEAD: Final = 2
+    ##  Most blocks of latency
+    MAX_AHEAD: Final = 8
+
+    ##  Initialize the tuner.
+    #  @param self Object pointer
+    #  @param rate Sample rate
+    #  @param adaptive Change the latency with the load
+    #  @param blocksize Starting block size, or None for the device default
+    #  @param latency Starting latency in seconds, or None for the device default
+    def __init__(self, rate, adaptive=False, blocksize=None, latency=None):
+        ##  Store the sample rate
+        self.__sample_rate: Final = rate
+        ##  Store if adaptive
+        self.__adaptive: Final = adaptive
+        self.__blocksize = blocksize
+        self.__blocks_ahead = self.MIN_AHEAD
+        if blocksize is not None and latency is not None:
+            self.__blocks_ahead = min(max(round(latency * rate / blocksize), self.MIN_AHEAD), self.MAX_AHEAD)
+        self.__load = 0.0
+        self.__busy_time = 0.0
+        self.__idle_time = 0.0
+        self.__changed = False
+
+    ##  Check if the latency changes with the load.
+    #  @param self Object pointer
+    #  @return True if adaptive, else false
+    def is_adaptive(self):
+        return self.__adaptive
+
+    ##  Get the block size.
+    #  @param self Object pointer
+    #  @return Block size, or None for the device default
+    def get_blocksize(self):
+        return self.__blocksize
+
+    ##  Get the time one audio block takes to play.
+    #  A typical block size is used when the device picks its own.
+    #  @param self Object pointer
+    #  @return Block time in seconds
+    def get_block_time(self):
+        return (self.__blocksize or self.DEFAULT_BLOCKSIZE) / self.__sample_rate
+
+    ##  Get the latency.
+    #  @param self Object pointer
+    #  @return Latency in seconds, or None for the device default
+    def get_latency(self):
+        if self.__blocksize is None: return None
+        return self.__blocks_ahead * self.__blocksize / self.__sample_rate
+
+    ##  Get the average share of each block's time used by the callback.
+    #  @param self Object pointer
+    #  @return Callback load
+    def get_load(self):
+        return self.__load
+
+    ##  Pick the smallest block size the callback can safely keep up with.
+    #  @param self Object pointer
+    #  @param time_block Function that renders a block size and returns its worst time in seconds
+    #  @return Chosen block size
+    def pick_blocksize(self, time_block):
+        for blocksize in self.BLOCK_SIZES:
+            if time_block(blocksize) < self.__SAFE_LOAD * blocksize / self.__sample_rate: break
+        self.__blocksize = blocksize
+        self.__blocks_ahead = self.MIN_AHEAD
+        return blocksize
+
+    ##  Measure the cost of a callback.
+    #  Called from the audio thread after each block.
+    #  @param self Object pointer
+    #  @param elapsed_ns Time the callback took in nanoseconds
+    #  @param frame_size Size of the block
+    #  @param underflow True if the output ran dry
+    def measure(self, elapsed_ns, frame_size, underflow):
+        deadline = frame_size / self.__sample_rate
+        self.__load += (elapsed_ns / 1e9 / deadline - self.__load) * self.__LOAD_SMOOTHING
+        if not self.__adaptive or self.__blocksize is None: return
+
+        if underflow or self.__load > self.__HIGH_LOAD:
+            self.__busy_time += deadline
+            self.__idle_time = 0.0
+        elif self.__load < self.__LOW_LOAD:
+            self.__idle_time += deadline
+            self.__busy_time = 0.0
+        else:
+            self.__busy_time = 0.0
+            self.__idle_time = 0.0
+
+        #  An underflow adds latency right away
+        if (underflow or self.__busy_time >= self.__RAISE_TIME) and self.__blocks_ahead < self.MAX_AHEAD:
+            self.__blocks_ahead += 1
+            self.__busy_time = 0.0
+            self.__changed = True
+        elif self.__idle_time >= self.__LOWER_TIME and self.__blocks_ahead > self.MIN_AHEAD:
+            self.__blocks_ahead -= 1
+            self.__idle_time = 0.0
+            self.__changed = True
+
+    ##  Check if the latency was changed since the last check.
+    #  @param self Object pointer
+    #  @return True if changed, else false
+    def check_changed(self):
+        changed = self.__changed
+        self.__changed = False
+        return changed
+
+##  Parameters shared between the input threads and the audio thread.
+#  Values are kept in a preallocated array guarded by a version counter.
+#  Writers take a lock and make the version odd while writing.  The audio
+#  thread copies a snapshot without locking and retries if the version
+#  changed, so every block sees a consistent set of values.
+class param_store(object):
+    ##  Times to retry a snapshot before keeping the last one
+    __RETRIES: Final = 8
+
+    ##  Initialize the store.
+    #  @param self Object pointer
+    #  @param capacity Largest number of parameters
+    def __init__(self, capacity=256):
+        self.__values = np.zeros(capacity, dtype=np.float64)
+        self.__changed = np.zeros(capacity, dtype=np.int64)
+        self.__snap_values = np.zeros(capacity, dtype=np.float64)
+        self.__snap_changed = np.zeros(capacity, dtype=np.int64)
+        #  Snapshots are copied here first, then swapped in once known to be whole
+        self.__scratch_values = np.zeros(capacity, dtype=np.float64)
+        self.__scratch_changed = np.zeros(capacity, dtype=np.int64)
+        self.__snap_count = 0
+        self.__snap_version = 0
+        self.__count = 0
+        self.__version = 0
+        self.__names = dict()
+        self.__types = []
+        self.__targets = []
+        self.__bindings = []
+        self.__lock = threading.Lock()
+
+    ##  Add a parameter.
+    #  Adding a parameter that already exists returns its index.
+    #  @param self Object pointer
+    #  @param name Name of the parameter
+    #  @param value Starting value
+    #  @param ptype Type values are returned as
+    #  @param target Patchboard to set the parameter on, or None
+    #  @param binding Binding name to set on the patchboard
+    #  @return Index of the parameter
+    def register(self, name, value=0, ptype=int, target=None, binding=None):
+        with self.__lock: return self.__register(name, value, ptype, target, binding)
+
+    ##  Add a parameter.  Must be called holding the lock.
+    #  @param self Object pointer
+    #  @param name Name of the parameter
+    #  @param value Starting value
+    #  @param ptype Type values are returned as
+    #  @param target Patchboard to set the parameter on, or None
+    #  @param binding Binding name to set on the patchboard
+    #  @return Index of the parameter
+    def __register(self, name, value, ptype, target, binding):
+        if name in self.__names: return self.__names[name]
+        if self.__count == self.__values.shape[0]: raise IndexError("Parameter store is full")
+        index = self.__count
+        self.__values[index] = value
+        self.__changed[index] = 0
+        self.__types.append(ptype)
+        self.__targets.append(target)
+        self.__bindings.append(binding)
+        self.__names[name] = index
+        self.__count += 1
+        return index
+
+    ##  Get the index of a parameter.
+    #  @param self Object pointer
+    #  @param name Name of the parameter
+    #  @return Index of the parameter
+    def index(self, name):
+        return self.__names[name]
+
+    ##  Get the current value of a parameter.
+    #  @param self Object pointer
+    #  @param name Name of the parameter
+    #  @return Parameter value
+    def get(self, name):
+        index = self.__names[name]
+        return self.__types[index](self.__values[index])
+
+    ##  Set a parameter.
+    #  Module controls are added the first time they are set.
+    #  @param self Object pointer
+    #  @param name Name of the parameter
+    #  @param value New value to set
+    #  @param target Patchboard to set the parameter on, or None
+    #  @param binding Binding name to set on the patchboard
+    def set(self, name, value, target=None, binding=None):
+        self.set_many([ [ name, value, target, binding ] ])
+
+    ##  Set a group of parameters at once.
+    #  The audio thread sees either none or all of the new values.
+    #  Raises ValueError before anything is set if a value isn't a finite number.
+    #  @param self Object pointer
+    #  @param params List of name, value, target, binding
+    def set_many(self, params):
+        values = [ self.__convert(param[1]) for param in params ]
+        with self.__lock:
+            indices = [ self.__register(param[0], param[1], float if isinstance(param[1], float) else int,
+                param[2], param[3]) for param in params ]
+            self.__version += 1
+            try:
+                for index, value in zip(indices, values):
+                    self.__values[index] = value
+                    self.__changed[index] = self.__version + 1
+            finally:
+                #  Always leave an even version, or snapshots would never succeed
+                self.__version += 1
+
+    ##  Convert a value for storing.
+    #  @param value Value to convert
+    #  @return Value as a float
+    @staticmethod
+    def __convert(value):
+        if isinstance(value, (str, bytes)) or value is None:
+            raise ValueError("Parameter value must be a number", value)
+        value = float(value)
+        if not math.isfinite(value): raise ValueError("Parameter value must be finite", value)
+        return value
+
+    ##  Copy a consistent snapshot of all parameters.
+    #  Called from the audio thread once per block.  Never locks.
+    #  If every try overlaps a write, the last whole snapshot is kept.
+    #  @param self Object pointer
+    #  @return Tuple of the snapshot values and its version
+    def snapshot(self):
+        for _ in range(self.__RETRIES):
+            version = self.__version
+            #  Odd versions are being written
+            if version % 2: continue
+            count = self.__count
+            np.copyto(self.__scratch_values[:count], self.__values[:count])
+            np.copyto(self.__scratch_changed[:count], self.__changed[:count])
+            if version == self.__version:
+                self.__snap_values, self.__scratch_values = self.__scratch_values, self.__snap_values
+                self.__snap_changed, self.__scratch_changed = self.__scratch_changed, self.__snap_changed
+                self.__snap_count = count
+                self.__snap_version = version
+                break
+        return self.__snap_values, self.__snap_version
+
+    ##  Get the parameters in the snapshot changed after a version.
+    #  @param self Object pointer
+    #  @param version Version to compare against
+    #  @return Array of parameter indices
+    def changes(self, version):
+        return np.flatnonzero(self.__snap_changed[:self.__snap_count] > version)
+
+    ##  Convert a value to the type of a parameter.
+    #  @param self Object pointer
+    #  @param index Index of the parameter
+    #  @param value Value to convert
+    #  @return Converted value
+    def cast(self, index, value):
+        if self.__types[index] is int: return int(round(value))
+        return self.__types[index](value)
+
+    ##  Get the patchboard a parameter is set on.
+    #  @param self Object pointer
+    #  @param index Index of the parameter
+    #  @return Tuple of the patchboard and binding name, or None for other parameters
+    def get_target(self, index):
+        if self.__targets[index] is None: return None
+        return self.__targets[index], self.__bindings[index]
+
+##  Reads and writes OSC messages and bundles.
+#  Used by the control endpoint and its test client.
+#  Supports int, float, double, long, string and true/false arguments.
+class osc_codec(object):
+    ##  Header that starts a bundle
+    BUNDLE: Final = b"#bundle\0"
+    ##  Size of the header and time tag of a bundle
+    __BUNDLE_HEADER: Final = 16
+    ##  Packing format of each fixed size argument type
+    __FORMATS: Final = { 'i': ">i", 'f': ">f", 'd': ">d", 'h': ">q" }
+
+    ##  Read a padded string.
+    #  @param data Packet data
+    #  @param pos Position of the string
+    #  @return Tuple of the string and the position after its padding
+    @staticmethod
+    def __read_string(data, pos):
+        end = data.find(b"\0", pos)
+        if end < 0: raise ValueError("Unterminated OSC string")
+        return data[pos:end].decode("utf-8"), (end + 4) & ~3
+
+    ##  Pad a string to a multiple of four bytes.
+    #  @param text String to pad
+    #  @return Padded string data
+    @staticmethod
+    def __pad_string(text):
+        data = text.encode("utf-8") + b"\0"
+        return data + b"\0" * (-len(data) % 4)
+
+    ##  Read all messages in a packet.
+    #  Messages in bundles are returned in order.  Time tags are ignored.
+    #  @param data Packet data
+    #  @return List of address, arguments tuples
+    @classmethod
+    def parse(cls, data):
+        if data.startswith(cls.BUNDLE):
+            messages = []
+            pos = cls.__BUNDLE_HEADER
+            while pos < len(data):
+                if pos + 4 > len(data): raise ValueError("Truncated OSC bundle")
+                size = struct.unpack_from(">i", data, pos)[0]
+                pos += 4
+                if size < 0 or pos + size > len(data): raise ValueError("Truncated OSC bundle")
+                messages += cls.parse(data[pos:pos + size])
+                pos += size
+            return messages
+        address, pos = cls.__read_string(data, 0)
+        if not address.startswith("/"): raise ValueError("Invalid OSC address")
+        if pos >= len(data): return [ (address, []) ]
+        tags, pos = cls.__read_string(data, pos)
+        if not tags.startswith(","): raise ValueError("Invalid OSC type tags")
+        args = []
+        try:
+            for tag in tags[1:]:
+                if tag in cls.__FORMATS:
+                    args.append(struct.unpack_from(cls.__FORMATS[tag], data, pos)[0])
+                    pos += struct.calcsize(cls.__FORMATS[tag])
+                elif tag == 's':
+                    text, pos = cls.__read_string(data, pos)
+                    args.append(text)
+                elif tag == 'T': args.append(True)
+                elif tag == 'F': args.append(False)
+                else: raise ValueError("Unsupported OSC type: " + tag)
+        except struct.error: raise ValueError("Truncated OSC message")
+        return [ (address, args) ]
+
+    ##  Build a message.
+    #  @param address Address of the message
+    #  @param args Arguments to send
+    #  @return Message data
+    @classmethod
+    def message(cls, address, *args):
+        tags, data = ",", b""
+        for arg in args:
+            if isinstance(arg, bool): tags += 'T' if arg else 'F'
+            elif isinstance(arg, int):
+                tags += 'i'
+                data += struct.pack(">i", arg)
+            elif isinstance(arg, float):
+                tags += 'f'
+                data += struct.pack(">f", arg)
+            else:
+                tags += 's'
+                data += cls.__pad_string(str(arg))
+        return cls.__pad_string(address) + cls.__pad_string(tags) + data
+
+    ##  Build a bundle to be handled right away.
+    #  @param messages List of message data
+    #  @return Bundle data
+    @classmethod
+    def bundle(cls, messages):
+        #  Time tag of 1 means immediately
+        data = cls.BUNDLE + struct.pack(">Q", 1)
+        for message in messages: data += struct.pack(">i", len(message)) + message
+        return data
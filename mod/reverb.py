@@ -6,22 +6,61 @@
 #  See LICENSE.md for copyright information.
 #
 
-from .parts import synthmod
+from .parts import voice_synthmod
+from typing import Final
 import numpy as np
 
-##  PPMS Synth Module for reverb.  Shifts the signal and adds to original.
-class reverberation(synthmod):
-    ##  Store reverb amount
-    __reverb = 0
+##  PPMS Synth Module for reverb.  Feeds the signal back through a delay line.
+#  Each voice has its own delay line, so released notes ring out.
+class reverberation(voice_synthmod):
+    ##  Delay line length in samples
+    DELAY: Final = 1103
+    ##  Largest feedback amount at full reverb
+    MAX_FEEDBACK: Final = 0.8
+    ##  Level a tail must stay above to keep playing
+    TAIL_LEVEL: Final = 1e-4
 
-    ## Reverb process - Add a shifted array to the signal.
+    ##  Allocate a delay line for each voice.
     #  @param self Object pointer
-    #  @param signal Signal data to modify
+    #  @param voices Number of voice slots
+    def init_voices(self, voices):
+        self.__reverb = 0
+        self.__lines = np.zeros((voices, self.DELAY), dtype=np.float64)
+
+    ##  Clear the delay line when a voice starts a new note.
+    #  @param self Object pointer
+    #  @param voice Voice slot to reset
+    def start_voice(self, voice):
+        self.__lines[voice].fill(0)
+
+    ## Reverb process - Add the delayed output back to the signal.
+    #  Works through the block one delay length at a time for all voices.
+    #  @param self Object pointer
+    #  @param voices Array of voice slots being played
+    #  @param notes Notes played by each voice
+    #  @param signals Signal data to modify, one row for each voice
     #  @return Modified signal data
-    def process(self, note, signal):
-        if self.__reverb > self.MIDI_MIN:
-            signal += np.roll(signal, int(signal.size * (self.__reverb / self.MIDI_MAX)))
-        return signal
+    def process_voices(self, voices, notes, signals):
+        if self.__reverb <= self.MIDI_MIN: return signals
+        feedback = self.MAX_FEEDBACK * self.__reverb / self.MIDI_MAX
+        frame_size = signals.shape[1]
+        #  Past output followed by the new block
+        output = np.concatenate((self.__lines[voices], signals[:, :, 0]), axis=1)
+        for pos in range(self.DELAY, self.DELAY + frame_size, self.DELAY):
+            end = min(pos + self.DELAY, self.DELAY + frame_size)
+            output[:, pos:end] += feedback * output[:, pos - self.DELAY:end - self.DELAY]
+        self.__lines[voices] = output[:, -self.DELAY:]
+        signals[:, :, 0] = output[:, self.DELAY:]
+        return signals
+
+    ##  Check if the delay line still holds sound for a released voice.
+    #  @param self Object pointer
+    #  @param voice Voice slot playing the note
+    #  @param note Note to check
+    #  @return True if the delay line has a tail, else false
+    def voice_tail_active(self, voice, note):
+        return self.__reverb > self.MIDI_MIN and \
+            np.max(np.abs(self.__lines[voice])) > self.TAIL_LEVEL
 
     ##  Build an array of save data for the module.
     #  Bindings should have the format class_name.member_name.
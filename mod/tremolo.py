@@ -0,0 +1,25 @@
+#
+#  Python Polyphonic MIDI Synthesizer
+#
+#  Filename:  tremolo.py
+#  By:  Matthew Evans
+#  See LICENSE.md for copyright information.
+#
+
+from .parts import synthmod, mod_control
+
+##  PPMS Synth Module for tremolo.  The mod wheel sets the depth.
+class tremolo(synthmod, mod_control):
+    ##  Store the name of the modulation source to follow
+    __source = 'lfo1'
+
+    ## Tremolo process - Scale the signal by the LFO.
+    #  @param self Object pointer
+    #  @param signal Signal data to modify
+    #  @return Modified signal data
+    def process(self, note, signal):
+        depth = self.get_mod_value() / self.MIDI_MAX
+        lfo = self.get_mod_signal(self.__source)
+        if depth > 0 and lfo is not None:
+            signal = signal * (1 - depth * 0.5 * (1 + lfo))
+        return signal
@@ -15,17 +15,17 @@
 #
 ##################################################################
 
-import os, sys, time, json, asyncio, queue
+import os, sys, math, time, json, signal, asyncio, queue, threading
 import argparse, importlib, inspect
 from typing import Final
 
 import numpy as np
-import sounddevice as sd
 
-import rtmidi
-from rtmidi.midiutil import open_midiinput
+#  The audio and MIDI device libraries are imported where they're used,
+#  so the pipeline can be loaded without them, such as by ppms_golden.py
 
-from mod.parts import oscillator, patchboard, synthmod, mod_control
+from mod.parts import tuning, oscillator, sampler, patchboard, synthmod, mod_control, modulator, recorder, preset_bank, profiler
+from mod.parts import block_tuner, param_store, osc_codec, atomic_file
 
 ##################################################################
 #  Function to return a map of the default settings
@@ -35,7 +35,16 @@ def create_default_settings():
         #  Config settings
         'sample_rate': 44100.0,
         'impact_weight': 0.0006,
+        'midi_poll_time': 0.001,
+        'midi_idle_time': 0.01,
         'preset_folder': "presets",
+        'preset_bank': "presets.bank",
+        'bend_range': 2,
+        'tuning_file': None,
+        'record_folder': "recordings",
+        'voices': 32,
+        'autotune_voices': 16,
+        'osc_port': 9000,
 
         #  Key bindings
         'sawtooth_on': 144,
@@ -46,8 +55,21 @@ def create_default_settings():
         'square_off': 130,
         'sine_on': 147,
         'sine_off': 131,
+        'sampler_on': 148,
+        'sampler_off': 132,
         'preset_msg': 192,
 
+        #  Sampler zones
+        #  Format:  low_note, high_note, root_note, filename, loop_start, loop_end
+        'sampler_zones': [],
+
+        #  Multi-timbral mode
+        #  Each listed channel gets its own waveform and patchboard
+        'multitimbral': False,
+        'channels': [
+            { 'channel': 1, 'waveform': 'sawtooth', 'modules': [ 'mod.test' ], 'module_data': [] }
+        ],
+
         #  List modules to load
         #  Patchboard processes these in order
         'modules': [ 'mod.test' ],
@@ -63,6 +85,7 @@ def create_default_settings():
             [ 'pitch_wheel', 224, 0 ],
             [ 'mod_wheel', 176, 1 ],
             [ 'bpm', 176, 61 ],
+            [ 'record', 176, 62 ],
 
             #  Module bindings
             #  Binding names should have the format class_name.member_name
@@ -72,9 +95,24 @@ def create_default_settings():
         #  For saving module data
         'module_data': [],
 
+        #  Modulation sources
+        #  Format:  name, 'lfo', waveform, rate_hz
+        #       or  name, 'follower', attack_ms, release_ms
+        'mod_sources': [
+            [ 'lfo1', 'lfo', 'sine', 5.0 ],
+            [ 'follow1', 'follower', 10.0, 250.0 ]
+        ],
+
+        #  Modulation matrix
+        #  Format:  source, binding_name or mod_wheel, depth, offset
+        'mod_matrix': [],
+
+        #  Block size and latency chosen by --autotune for each output device
+        'audio_tuning': {},
+
         #  Variables
         'master_volume': 50,
-        'pitch_bend': 64,
+        'pitch_bend': 8192,
         'mod_value': 0,
     }
 
@@ -105,120 +143,323 @@ def load_ppms_modules(settings, patches):
 
 ##################################################################
 #  Function to load module parameter data
+#  When given the parameter store, all values are swapped in at once
 ##################################################################
-def load_module_data(settings, patches):
+def load_module_data(settings, patches, params=None):
+    batch = []
     for module_data in settings['module_data']:
         try:
-            mod = module_data[0].split(".", 1)
-            getattr(patches.get_module(mod[0]), mod[1])(patches.get_module(mod[0]), module_data[1])
+            #  The parameter store only holds numbers, set anything else directly
+            if(params is None or not isinstance(module_data[1], (int, float))
+            or not math.isfinite(module_data[1])):
+                patches.set_control(module_data[0], module_data[1])
+            else:
+                #  Make sure the module is loaded, the audio thread sets the value
+                patches.get_module(module_data[0].split(".", 1)[0])
+                batch.append([ module_data[0], module_data[1], patches, module_data[0] ])
         except:
             #  Report error and continue
             print("Unable to set: ", module_data[0])
+    if batch: params.set_many(batch)
 
 ##################################################################
-#  Input coroutine
-#  Get MIDI messages and process
-#  Creates the MIDI input handler then sleeps until exit
+#  Function to load a preset by number
+#  Uses the preset bank if one was loaded, otherwise the preset files
+#  Returns True if the preset was loaded
+##################################################################
+def load_preset(settings, patches, params, presets, number):
+    if presets.is_open():
+        try:
+            name, settings['module_data'] = presets.get(number)
+            load_module_data(settings, patches, params)
+            print(f"Preset {name} loaded!")
+            return True
+        except IndexError:
+            return False  #  No preset at that number, do nothing
+    if number < 0 or number >= len(settings['presets']): return False
+    try:
+        #  Open the preset file and load into module_data
+        with open(settings['preset_folder'] + "/" + settings['presets'][number], "r") as json_file:
+            settings['module_data'] = json.load(json_file)
+            load_module_data(settings, patches, params)
+            print(f"Preset {settings['preset_folder']}/{settings['presets'][number]} loaded!")
+            return True
+    except IOError:
+        #  Report error and continue
+        print("Error loading preset: ", settings['preset_folder'] + "/" + settings['presets'][number])
+    return False
+
+##################################################################
+#  Function to create the parameter store
+#  Holds the variables shared with the audio thread
+##################################################################
+def create_params(settings):
+    params = param_store()
+    params.register('master_volume', settings['master_volume'])
+    params.register('pitch_bend', settings['pitch_bend'])
+    params.register('mod_value', settings['mod_value'])
+    return params
+
+##################################################################
+#  Function to create the patchboards for multi-timbral channels
+#  Returns a map of MIDI channel to waveform and patchboard
+##################################################################
+def load_channels(settings):
+    channel_map = dict()
+    if not settings['multitimbral']: return channel_map
+    for channel in settings['channels']:
+        try:
+            patches = patchboard(settings['voices'])
+            load_ppms_modules(channel, patches)
+            load_module_data(channel, patches)
+            #  Channels are numbered 1 - 16 in settings
+            channel_map[channel['channel'] - 1] = [ channel['waveform'], patches ]
+            print("Loaded channel: ", channel['channel'])
+        except (KeyError, TypeError):
+            #  Report error and continue
+            print("Failed loading channel: ", channel)
+    return channel_map
+
 ##################################################################
-async def ppms_input(exit_event, settings, patches, gate, port, noimpact, verbose):
-    ##################################################################
-    #  \START/ MIDI Input handler   ♪ヽ( ⌒o⌒)人(⌒-⌒ )v ♪
-    ##################################################################
-    class midi_input_handler(object):
-        def __init__(self, port, weight, noimpact, verbose):
-            self.__port: Final = port
-            self.__weight: Final = weight
-            self.__noimpact: Final = noimpact
-            self.__verbose: Final = verbose
-            self.__wallclock = time.time()
-
-        #  ᕕ(⌐■_■)ᕗ ♪♬  MIDI Input handler callback
-        def __call__(self, event, data=None):
-            message, deltatime = event
+#  Function to save data to a JSON file
+#  The file is fully replaced or left as it was
+##################################################################
+def save_json(filename, data):
+    atomic_file.write(filename, json.dumps(data, indent=4))
+
+##################################################################
+#  Function to compile the preset files into the preset bank
+##################################################################
+def build_preset_bank(settings):
+    presets = []
+    for preset in settings['presets']:
+        with open(os.path.join(settings['preset_folder'], preset), "r") as json_file:
+            presets.append([ preset, json.load(json_file) ])
+    preset_bank.build(os.path.join(settings['preset_folder'], settings['preset_bank']), presets)
+
+##################################################################
+#  Function to export the preset bank to preset files
+##################################################################
+def export_preset_bank(settings, folder):
+    presets = preset_bank()
+    presets.open(os.path.join(settings['preset_folder'], settings['preset_bank']))
+    os.makedirs(folder, exist_ok=True)
+    for index in range(presets.count()):
+        name, module_data = presets.get(index)
+        save_json(os.path.join(folder, name), module_data)
+    presets.close()
+
+##################################################################
+#  Function to start or stop recording
+#  New recordings are named by time in the record folder
+##################################################################
+def toggle_recording(settings, rec, filename=None):
+    if rec.is_recording():
+        #  The recorder finishes the file on its own thread
+        print("Recording stopped, saving: ", rec.stop())
+        if rec.get_dropped() > 0:
+            print("Dropped frames while recording: ", rec.get_dropped())
+        return
+    if rec.is_saving():
+        print("Still saving the last recording!")
+        return
+    try:
+        if filename is None:
+            os.makedirs(settings['record_folder'], exist_ok=True)
+            filename = os.path.join(settings['record_folder'], time.strftime("ppms_%Y%m%d_%H%M%S.wav"))
+        rec.start(filename)
+        print("Recording to: ", filename)
+    except IOError:
+        #  Report error and continue
+        print("Error starting recording: ", filename)
+
+##################################################################
+#  \START/ MIDI Input handler   ♪ヽ( ⌒o⌒)人(⌒-⌒ )v ♪
+##################################################################
+class midi_input_handler(object):
+    ##  Bindings that act on each press, so their messages are never combined
+    __TRIGGERS: Final = ( "record", )
+
+    def __init__(self, settings, patches, channel_map, params, presets, gate, rec, port, noimpact, verbose):
+        self.__settings: Final = settings
+        self.__patches: Final = patches
+        self.__params: Final = params
+        self.__channel_map: Final = channel_map
+        self.__presets: Final = presets
+        self.__gate: Final = gate
+        self.__rec: Final = rec
+        self.__port: Final = port
+        self.__weight: Final = settings['impact_weight']
+        self.__noimpact: Final = noimpact
+        self.__verbose: Final = verbose
+        self.__wallclock = time.time()
+        self.__controls = dict()  #  Latest message of each controller waiting to be handled
+        #  Message type and controller number of each trigger binding
+        self.__triggers: Final = { (bindings[1] & 0xF0, bindings[2])
+            for bindings in settings['bindings'] if bindings[0] in self.__TRIGGERS }
+
+    #  ᕕ(⌐■_■)ᕗ ♪♬  MIDI Input handler callback
+    def __call__(self, event, data=None):
+        message, deltatime = event
+        self.__wallclock += deltatime
+        if(self.__verbose): print("[%s] @%0.6f %r" % (self.__port, self.__wallclock, message))
+        self.__try_handle(message)
+
+    #  ᕕ(⌐■_■)ᕗ ♪♬♬♬  Handle a batch of MIDI messages
+    #  Controllers and the pitch wheel are held until flush_controls,
+    #  so only their last value is handled
+    #  Notes and triggers are handled right away in the order received
+    def handle_batch(self, events):
+        controls = self.__controls
+        for message, deltatime in events:
             self.__wallclock += deltatime
             if(self.__verbose): print("[%s] @%0.6f %r" % (self.__port, self.__wallclock, message))
+            status = message[0] & 0xF0
+            if status == 0xB0 and len(message) == 3 and (status, message[1]) not in self.__triggers:
+                controls[(message[0], message[1])] = message
+            elif status == 0xE0 and len(message) == 3: controls[(message[0],)] = message
+            elif status in (0x80, 0x90): self.__try_handle(message)
+            else:
+                #  Anything else may depend on earlier controls, so handle those first
+                for control in controls.values(): self.__try_handle(control)
+                controls.clear()
+                self.__try_handle(message)
+
+    #  ᕕ(⌐■_■)ᕗ ♪  Handle the controllers held since the last flush
+    def flush_controls(self):
+        for control in self.__controls.values(): self.__try_handle(control)
+        self.__controls.clear()
+
+    #  Check if any controllers are waiting to be handled
+    def has_controls(self):
+        return len(self.__controls) > 0
+
+    #  ┐(￣ヘ￣)┌  Process a MIDI message, a bad one only loses itself
+    def __try_handle(self, message):
+        try: self.__handle(message)
+        except Exception as e:
+            #  Report error and continue
+            print("Error handling MIDI message: ", message, e)
 
-            #  ᕕ( ᐛ )ᕗ  Load a preset
-            if message[0] == settings['preset_msg']:
-                if message[1] < len(settings['presets']):
+    #  ᕕ( ᐛ )ᕗ  Process a MIDI message
+    def __handle(self, message):
+        settings, patches, channel_map = self.__settings, self.__patches, self.__channel_map
+        params, presets, gate, rec = self.__params, self.__presets, self.__gate, self.__rec
+
+        #  ᕕ( ᐛ )ᕗ  Load a preset
+        if message[0] == settings['preset_msg']:
+            load_preset(settings, patches, params, presets, message[1])
+            return
+
+        #  Everything below needs a status and two data bytes
+        if len(message) < 3: return
+
+        #  ᕙ[･۝･]ᕗ  Calculate impact
+        if(self.__noimpact): impact = self.__weight
+        else: impact = ((message[2] / 127) * 1.01) * self.__weight
+
+        #  ♪┏(・o･)┛♪  Play a note on a multi-timbral channel
+        channel = message[0] & 0x0F
+        if channel in channel_map and (message[0] & 0xF0) in (0x80, 0x90):
+            #  Note on with no velocity is a note off
+            if (message[0] & 0xF0) == 0x90 and message[2] > 0: status = 'on'
+            else: status = 'off'
+            gate.put({'status': status, 'channel': channel, 'note': message[1],
+                'waveform': channel_map[channel][0], 'impact': impact})
+            return
+
+        #  Note on with no velocity is a note off
+        on_status = 'on' if message[2] > 0 else 'off'
+
+        #  ༼つ ◕_◕ ༽つ  Play saw note
+        if message[0] == settings['sawtooth_on']:
+            gate.put({'status': on_status, 'channel': channel, 'note': message[1], 'waveform': 'sawtooth', 'impact': impact})
+            return
+        if message[0] == settings['sawtooth_off']:
+            gate.put({'status': 'off', 'channel': channel, 'note': message[1], 'waveform': 'sawtooth', 'impact': impact})
+            return
+
+        #  ༼つ ◕_◕ ༽つ  Play triangle note
+        if message[0] == settings['triangle_on']:
+            gate.put({'status': on_status, 'channel': channel, 'note': message[1], 'waveform': 'triangle', 'impact': impact})
+            return
+        if message[0] == settings['triangle_off']:
+            gate.put({'status': 'off', 'channel': channel, 'note': message[1], 'waveform': 'triangle', 'impact': impact})
+            return
+
+        #  ༼つ ◕_◕ ༽つ  Play square note
+        if message[0] == settings['square_on']:
+            gate.put({'status': on_status, 'channel': channel, 'note': message[1], 'waveform': 'square', 'impact': impact})
+            return
+        if message[0] == settings['square_off']:
+            gate.put({'status': 'off', 'channel': channel, 'note': message[1], 'waveform': 'square', 'impact': impact})
+            return
+
+        #  ༼つ ◕_◕ ༽つ  Play sine note
+        if message[0] == settings['sine_on']:
+            gate.put({'status': on_status, 'channel': channel, 'note': message[1], 'waveform': 'sine', 'impact': impact})
+            return
+        if message[0] == settings['sine_off']:
+            gate.put({'status': 'off', 'channel': channel, 'note': message[1], 'waveform': 'sine', 'impact': impact})
+            return
+
+        #  ༼つ ◕_◕ ༽つ  Play sampler note
+        if message[0] == settings['sampler_on']:
+            gate.put({'status': on_status, 'channel': channel, 'note': message[1], 'waveform': 'sampler', 'impact': impact})
+            return
+        if message[0] == settings['sampler_off']:
+            gate.put({'status': 'off', 'channel': channel, 'note': message[1], 'waveform': 'sampler', 'impact': impact})
+            return
+
+        #  (☞ﾟヮﾟ)☞  Check bindings
+        for bindings in settings['bindings']:
+            #  Multi-timbral channels match a binding on any channel
+            if channel in channel_map: status_match = (message[0] & 0xF0) == (bindings[1] & 0xF0)
+            else: status_match = message[0] >= bindings[1] and message[0] <= bindings[1] + 3
+            if(status_match and (message[1] == bindings[2] or bindings[0] == "pitch_wheel")):
+                #  Adjust master volume
+                if(bindings[0] == "master_volume"):
+                    params.set('master_volume', message[2])
+                    return
+                #  Check the pitch wheel
+                elif(bindings[0] == "pitch_wheel"):
+                    #  Combine LSB and MSB into the 14-bit bend value
+                    params.set('pitch_bend', (message[2] << 7) | message[1])
+                    return
+                #  Check the mod wheel
+                elif(bindings[0] == "mod_wheel"):
+                    params.set('mod_value', message[2])
+                    return
+                #  Start or stop recording on button press
+                elif(bindings[0] == "record"):
+                    if message[2] > 0: toggle_recording(settings, rec)
+                    return
+                #  Add another binding
+                #elif:
+                    #return
+                #  Find the loaded module and process its control
+                #  The audio thread sets it before the next block
+                else:
                     try:
-                        #  Open the preset file and load into module_data
-                        with open(settings['preset_folder'] + "/" + settings['presets'][message[1]], "r") as json_file:
-                            settings['module_data'] = json.load(json_file)
-                            load_module_data(settings, patches)
-                            print(f"Preset {settings['preset_folder']}/{settings['presets'][message[1]]} loaded!")
-                    except IOError:
-                        #  Report error and continue
-                        print("Error loading preset: ", settings['preset_folder'] + "/" + settings['presets'][message[1]])
-                return
-
-            #  ᕙ[･۝･]ᕗ  Calculate impact
-            if(self.__noimpact): impact = self.__weight
-            else: impact = ((message[2] / 127) * 1.01) * self.__weight
-
-            #  ༼つ ◕_◕ ༽つ  Play saw note
-            if message[0] == settings['sawtooth_on']:
-                gate.put({'status': 'on', 'note': message[1], 'waveform': 'sawtooth', 'impact': impact})
-                return
-            if message[0] == settings['sawtooth_off']:
-                gate.put({'status': 'off', 'note': message[1], 'waveform': 'sawtooth', 'impact': impact})
-                return
-
-            #  ༼つ ◕_◕ ༽つ  Play triangle note
-            if message[0] == settings['triangle_on']:
-                gate.put({'status': 'on', 'note': message[1], 'waveform': 'triangle', 'impact': impact})
-                return
-            if message[0] == settings['triangle_off']:
-                gate.put({'status': 'off', 'note': message[1], 'waveform': 'triangle', 'impact': impact})
-                return
-
-            #  ༼つ ◕_◕ ༽つ  Play square note
-            if message[0] == settings['square_on']:
-                gate.put({'status': 'on', 'note': message[1], 'waveform': 'square', 'impact': impact})
-                return
-            if message[0] == settings['square_off']:
-                gate.put({'status': 'off', 'note': message[1], 'waveform': 'square', 'impact': impact})
-                return
-
-            #  ༼つ ◕_◕ ༽つ  Play sine note
-            if message[0] == settings['sine_on']:
-                gate.put({'status': 'on', 'note': message[1], 'waveform': 'sine', 'impact': impact})
-                return
-            if message[0] == settings['sine_off']:
-                gate.put({'status': 'off', 'note': message[1], 'waveform': 'sine', 'impact': impact})
-                return
-
-            #  (☞ﾟヮﾟ)☞  Check bindings
-            for bindings in settings['bindings']:
-                if(message[0] >= bindings[1] and message[0] <= bindings[1] + 3
-                and message[1] == bindings[2]):
-                    #  Adjust master volume
-                    if(bindings[0] == "master_volume"):
-                        settings['master_volume'] = message[2]
-                        return
-                    #  Check the pitch wheel
-                    elif(bindings[0] == "pitch_wheel"):
-                        settings['pitch_bend'] = message[2]
-                        return
-                    #  Check the mod wheel
-                    elif(bindings[0] == "mod_wheel"):
-                        settings['mod_value'] = message[2]
-                        mod_control.set_mod_value(settings['mod_value'])
-                        return
-                    #  Add another binding
-                    #elif:
-                        #return
-                    #  Find the loaded module and process its control
-                    else:
-                        try:
-                            mod = bindings[0].split(".", 1)
-                            getattr(patches.get_module(mod[0]), mod[1])(patches.get_module(mod[0]), message[2])
-                        except:
-                            pass  #  If binding not found, do nothing
-                        return
-    ##################################################################
-    #  \END/ MIDI Input handler         ( ຈ ﹏ ຈ )
-    ##################################################################
+                        #  Multi-timbral channels control their own patchboard
+                        if channel in channel_map:
+                            params.set(f"{channel + 1}:{bindings[0]}", message[2], channel_map[channel][1], bindings[0])
+                        else: params.set(bindings[0], message[2], patches, bindings[0])
+                    except IndexError:
+                        pass  #  If the store is full, do nothing
+                    return
+##################################################################
+#  \END/ MIDI Input handler         ( ຈ ﹏ ຈ )
+##################################################################
+
+##################################################################
+#  Input coroutine
+#  Get MIDI messages and process
+#  Creates the MIDI input handler then sleeps until exit
+##################################################################
+async def ppms_input(exit_event, settings, patches, channel_map, params, presets, gate, rec, tuner, port, noimpact, verbose):
+    import rtmidi
+    from rtmidi.midiutil import open_midiinput
 
     #  Connect to MIDI device
     try:
@@ -238,86 +479,426 @@ async def ppms_input(exit_event, settings, patches, gate, port, noimpact, verbos
         sys.exit(1)
 
     #  Create the MIDI handler
-    try:
-        midiin.set_callback(
-            midi_input_handler(port_name, settings['impact_weight'], noimpact, verbose)
-        )
-    except:
-        print("Error creating MIDI callback!  Exiting...")
-        sys.exit(1)
+    handler = midi_input_handler(
+        settings, patches, channel_map, params, presets, gate, rec,
+        port_name, noimpact, verbose
+    )
+    stop_polling = threading.Event()
+
+    #  Poll the MIDI port and handle everything received since the last poll
+    #  Polls less often while no input arrives, up to the idle time
+    #  Controllers are combined over one audio block, since the audio thread
+    #  only reads them once per block
+    def poll_midi():
+        poll_time = settings['midi_poll_time']
+        flush_time = time.perf_counter()
+        while not stop_polling.is_set():
+            events = []
+            while True:
+                event = midiin.get_message()
+                if event is None: break
+                events.append(event)
+            try:
+                if events: handler.handle_batch(events)
+                if handler.has_controls() and time.perf_counter() >= flush_time:
+                    handler.flush_controls()
+                    flush_time = time.perf_counter() + tuner.get_block_time()
+            except Exception as e:
+                #  Report error and keep polling
+                print("Error handling MIDI input: ", e)
+            if events: poll_time = settings['midi_poll_time']
+            else: poll_time = min(poll_time * 2, max(settings['midi_idle_time'], settings['midi_poll_time']))
+            #  Wake up in time to handle held controllers
+            wait_time = poll_time
+            if handler.has_controls(): wait_time = min(poll_time, max(flush_time - time.perf_counter(), 0))
+            stop_polling.wait(wait_time)
+
+    poll_thread = threading.Thread(target=poll_midi, daemon=True)
+    poll_thread.start()
     print("Connected to: ", port_name)
 
     #  Run until exit event
     await exit_event.wait()
+    stop_polling.set()
+    poll_thread.join()
     del midiin
 
 ##################################################################
-#  Output coroutine
-#  Gets on/off signals from the gate and updates the playing notes
-#  Creates the audio output callback then sleeps until exit
+#  Function to create the audio callback
+#  Renders playing notes from the note queue into each output block
 ##################################################################
-async def ppms_output(exit_event, device, settings, patches, note_queue, osc):
+def create_audio_callback(settings, patches, channel_map, params, note_queue, osc, samp, tune, mods, rec, prof):
     time_index = 0  #  Index for audio output stream
-    note_map = dict()  #  Map to store playing notes
+    params_version = 0  #  Version of the last parameters applied
+    volume_param = params.index('master_volume')
+    bend_param = params.index('pitch_bend')
+    mod_param = params.index('mod_value')
+    note_map = dict()  #  Map to store playing notes by channel and note
+    free_voices = list(range(patches.get_voices()))  #  Voice slots not playing a note
+    #  All patchboards, for the modulation matrix
+    boards = [ patches ] + [ channel[1] for channel in channel_map.values() ]
+    mix = np.zeros(shape=(0,1), dtype=np.float32)  #  Buffer to mix notes into
+
+    #  Get the patchboard that plays a channel
+    def get_patches(channel):
+        if channel in channel_map: return channel_map[channel][1]
+        return patches
+
+    #  Give a new note a voice slot, taking the oldest note's slot if all are playing
+    def start_voice(key):
+        nonlocal note_map, free_voices
+        if key in note_map: voice = note_map.pop(key)[3]
+        elif free_voices: voice = free_voices.pop()
+        else:
+            oldest = next(iter(note_map))
+            voice = note_map.pop(oldest)[3]
+            samp.release(oldest)
+        get_patches(key[0]).start_voice(voice)
+        return voice
 
-    #  Audio callback.  Generates the waveforms based on the input
+    #  Stop a note and free its voice slot
+    def stop_voice(key):
+        nonlocal note_map, free_voices
+        free_voices.append(note_map.pop(key)[3])
+        samp.release(key)
+
+    #  Take a snapshot of the parameters and set any that changed
+    def apply_params():
+        nonlocal params, params_version
+        values, version = params.snapshot()
+        if version == params_version: return values
+        for index in params.changes(params_version):
+            if index == mod_param:
+                mod_control.set_mod_value(params.cast(index, values[index]))
+                continue
+            target = params.get_target(index)
+            if target is None: continue
+            try: target[0].set_control(target[1], params.cast(index, values[index]))
+            except: pass  #  If binding not found, do nothing
+        params_version = version
+        return values
+
+    #  Generates the waveforms of all playing notes into the mix buffer
+    def render(frame_size, values):
+        nonlocal time_index, settings, osc, samp, tune, mods, prof, boards, note_map, mix
+
+        #  Rebuilds the bend table only if the range was changed
+        tune.set_bend_range(settings['bend_range'])
+
+        #  Calculate modulation sources once for all notes, then apply the matrix
+        start = prof.mark()
+        mods.process(frame_size)
+        mods.apply(boards)
+        prof.add(start, "modulation")
+
+        #  Look up the bent frequency of every playing note at once
+        #  The bend index is clipped so a bad stored value can't leave the table
+        freqs = tune.frequencies(
+            np.fromiter((key[1] for key in note_map), dtype=np.intp, count=len(note_map)),
+            min(max(int(values[bend_param]), 0), tune.BEND_COUNT - 1))
+
+        #  Generate the audio signal
+        #  Every channel is mixed into the same signal
+        if mix.shape[0] != frame_size: mix = np.zeros(shape=(frame_size,1), dtype=np.float32)
+        else: mix.fill(0)
+        finished = []
+        banks = dict()  #  Notes to patch, grouped by patchboard
+        oscillator_start = prof.mark()
+        for key, freq in zip(note_map, freqs):
+            try:
+                channel, note = key
+                note_data = note_map.get(key)
+                #  Notes played with no impact are silent
+                gain = values[volume_param] * note_data[1]
+                if gain == 0:
+                    if note_data[2]: finished.append(key)
+                    continue
+                #  Released notes only play the tail of their modules
+                start = prof.mark()
+                if note_data[2]: note_signal = np.zeros(shape=(frame_size,1), dtype=np.float32)
+                elif note_data[0] == 'sampler':
+                    note_signal = samp.play(key, note, freq, frame_size)
+                    #  A sample that ran out is released like a note off
+                    if not samp.is_playing(key, note): note_data[2] = True
+                else: note_signal = getattr(osc, note_data[0])(freq, frame_size, time_index)
+                prof.add(start, "oscillator", note_data[0])
+                banks.setdefault(get_patches(channel), []).append([ key, note_signal, gain ])
+            #  On errors generate nothing
+            except: pass
+        prof.add(oscillator_start, "oscillator")
+
+        #  Patch each bank of voices, then mix them
+        for voice_patches, bank in banks.items():
+            try:
+                voices = np.fromiter((note_map[item[0]][3] for item in bank), dtype=np.intp, count=len(bank))
+                start = prof.mark()
+                signals = voice_patches.patch(voices, [ item[0][1] for item in bank ], np.stack([ item[1] for item in bank ]))
+                prof.add(start, "patchboard")
+                for item, voice in zip(bank, voices):
+                    if note_map[item[0]][2] and not voice_patches.tail_active(voice, item[0][1]): finished.append(item[0])
+                #  volume * impact * waveform(freq, frame_size, time_index)
+                start = prof.mark()
+                np.add(mix, np.tensordot(np.fromiter((item[2] for item in bank), dtype=np.float64, count=len(bank)), signals, axes=1), out=mix)
+                prof.add(start, "mix")
+            #  Raise error if there's a problem with a module implementation
+            except NotImplementedError as e: raise
+            #  On all other errors generate nothing
+            except: pass
+        for key in finished: stop_voice(key)
+
+    #  Audio callback.  Renders the playing notes or outputs silence when idle
     def audio_callback(outdata, frame_size, time, status):
-        nonlocal time_index, settings, osc, patches, note_map, note_queue
-
-        #  Check pitch bend
-        pitch_bend = 0
-        if settings['pitch_bend'] < 64 or settings['pitch_bend'] > 64:
-            #  Pitch down
-            if settings['pitch_bend'] < 64:
-                if settings['pitch_bend'] == 0: pitch_bend = 0.5 / -64
-                else: pitch_bend = settings['pitch_bend'] / -64
-            #  Pitch up
-            if settings['pitch_bend'] > 64:
-                pitch_bend = settings['pitch_bend'] / 127
+        nonlocal time_index, settings, samp, mods, rec, prof, note_map, note_queue, mix
+        callback_start = prof.mark()
+
+        #  All parameters for this block come from one snapshot
+        values = apply_params()
 
         #  Process note queue
+        start = prof.mark()
         while True:
             try:
                 signal = note_queue.get_nowait()
+                key = (signal['channel'], signal['note'])
                 if signal['status'] == 'on':
-                    note_map.update({ signal['note']: [ signal['waveform'], signal['impact'] ] })
-                if signal['status'] == 'off': del note_map[signal['note']]
+                    voice = start_voice(key)
+                    note_map.update({ key: [ signal['waveform'], signal['impact'], False, voice ] })
+                    if signal['waveform'] == 'sampler': samp.trigger(key)
+                if signal['status'] == 'off' and key in note_map:
+                    #  Keep the note until its modules finish their tail
+                    if get_patches(key[0]).tail_active(note_map[key][3], key[1]): note_map[key][2] = True
+                    else: stop_voice(key)
                 note_queue.task_done()
             #  Loop until queue is processed
             except: break
+        prof.add(start, "note_queue")
 
-        #  Generate the audio signal
-        audio_signal = np.zeros(shape=(frame_size,1), dtype=np.float32)
-        for note in note_map:
-            try:
-                note_data = note_map.get(note)
-                #  volume * impact * waveform(note, pitch_bend, frame_size, time_index)
-                audio_signal = np.add(audio_signal, (settings['master_volume'] * note_data[1]) *
-                    patches.patch(note, getattr(osc, note_data[0])(note, pitch_bend, frame_size, time_index)))
-            #  Raise error if there's a problem with a module implementation
-            except NotImplementedError as e: raise
-            #  On all other errors generate nothing
-            except: pass
-        outdata[:] = audio_signal
+        if note_map and values[volume_param] > 0:
+            render(frame_size, values)
+            start = prof.mark()
+            outdata[:] = mix
+            mods.follow(mix)
+        else:
+            #  Nothing can make sound, only fill the buffer
+            start = prof.mark()
+            outdata.fill(0)
+            mods.skip(frame_size)
+        #  Copy the block to the recorder if it's running
+        rec.tap(outdata)
+        prof.add(start, "output")
 
         #  Increment time index for next frame
         time_index += frame_size
         #  Just incase the time index gets too large
         if(time_index > sys.maxsize - frame_size - frame_size): time_index = 0
+        prof.add(callback_start)
+
+    return audio_callback
+
+##################################################################
+#  Function to time rendering at a block size
+#  Plays a chord of test notes and returns the slowest block time
+##################################################################
+def time_blocksize(settings, patches, channel_map, osc, samp, tune, blocksize):
+    test_queue = queue.Queue()
+    mods = modulator(settings['sample_rate'])
+    try: mods.load(settings['mod_sources'], settings['mod_matrix'])
+    except: mods.load([], [])
+    audio_callback = create_audio_callback(
+        settings, patches, channel_map, create_params(settings), test_queue, osc, samp, tune, mods,
+        recorder(settings['sample_rate'], buffer_seconds=1), profiler(False)
+    )
+    for voice in range(settings['autotune_voices']):
+        test_queue.put({'status': 'on', 'channel': voice // 128, 'note': voice % 128,
+            'waveform': 'sawtooth', 'impact': settings['impact_weight']})
+    outdata = np.zeros(shape=(blocksize,1), dtype=np.float32)
+    #  Warm up before timing
+    for _ in range(5): audio_callback(outdata, blocksize, None, None)
+    slowest = 0
+    for _ in range(50):
+        start = time.perf_counter_ns()
+        audio_callback(outdata, blocksize, None, None)
+        slowest = max(slowest, time.perf_counter_ns() - start)
+    return slowest / 1e9
+
+##################################################################
+#  Function to pick the block size for the tuner
+#  Timing runs on throwaway patchboards, so the live modules,
+#  their voice state and the profiler aren't touched
+#  Returns the block size picked
+##################################################################
+def autotune_blocksize(settings, tuner, osc, samp, tune):
+    patches = patchboard(settings['voices'])
+    load_ppms_modules(settings, patches)
+    load_module_data(settings, patches)
+    channel_map = load_channels(settings)
+    #  The modulation matrix can route to the mod wheel, which all patchboards share
+    mod_value = mod_control.get_mod_value()
+    blocksize = tuner.pick_blocksize(
+        lambda blocksize: time_blocksize(settings, patches, channel_map, osc, samp, tune, blocksize)
+    )
+    mod_control.set_mod_value(mod_value)
+    return blocksize
 
-    #  Set the audio callback
-    if device is not None:
+##################################################################
+#  Output coroutine
+#  Gets on/off signals from the gate and updates the playing notes
+#  Creates the audio output callback then sleeps until exit
+##################################################################
+async def ppms_output(exit_event, device, settings, patches, channel_map, params, note_queue, osc, samp, tune, mods, rec, prof, tuner):
+    import sounddevice as sd
+
+    audio_callback = create_audio_callback(
+        settings, patches, channel_map, params, note_queue, osc, samp, tune, mods, rec, prof
+    )
+
+    #  Time each block so the tuner can follow the load
+    def tuned_callback(outdata, frame_size, time_info, status):
+        start = time.perf_counter_ns()
+        audio_callback(outdata, frame_size, time_info, status)
+        tuner.measure(time.perf_counter_ns() - start, frame_size, status.output_underflow)
+
+    while True:
+        #  Set the audio callback
         stream = sd.OutputStream(
-            callback=audio_callback, channels=1, dtype=np.float32,
-            device=device, samplerate=settings['sample_rate']
+            callback=tuned_callback if tuner.is_adaptive() else audio_callback,
+            channels=1, dtype=np.float32, device=device, samplerate=settings['sample_rate'],
+            blocksize=tuner.get_blocksize(), latency=tuner.get_latency()
         )
-    else:
-        stream = sd.OutputStream(
-            callback=audio_callback, channels=1, dtype=np.float32,
-            samplerate=settings['sample_rate']
+        #  Run until exit event, or until the tuner changes the latency
+        with stream:
+            while not exit_event.is_set():
+                try: await asyncio.wait_for(exit_event.wait(), timeout=1.0)
+                except asyncio.TimeoutError: pass
+                if tuner.check_changed(): break
+        if exit_event.is_set(): break
+        print(f"Output latency set to {tuner.get_latency() * 1000:.1f} ms  (load {tuner.get_load():.2f})")
+
+##################################################################
+#  OSC control endpoint
+#  Receives OSC messages over UDP from scripts on this machine
+#  Parameters are set through the parameter store, so the audio
+#  thread picks them up between blocks
+##################################################################
+class osc_control(asyncio.DatagramProtocol):
+    ##  Binding names of the shared variables and their parameter names
+    __GLOBALS: Final = {
+        'master_volume': 'master_volume', 'pitch_wheel': 'pitch_bend', 'pitch_bend': 'pitch_bend',
+        'mod_wheel': 'mod_value', 'mod_value': 'mod_value'
+    }
+    ##  Largest value of a parameter, the same range MIDI can send
+    __MAX_VALUE: Final = 127
+    __MAX_BEND: Final = 16383
+
+    def __init__(self, settings, patches, channel_map, params, presets, rec, tuner, verbose):
+        self.__settings: Final = settings
+        self.__patches: Final = patches
+        self.__channel_map: Final = channel_map
+        self.__params: Final = params
+        self.__presets: Final = presets
+        self.__rec: Final = rec
+        self.__tuner: Final = tuner
+        self.__verbose: Final = verbose
+        self.__targets = dict()  #  Binding names already looked up
+        self.__stats = { 'messages': 0, 'params': 0, 'presets': 0, 'errors': 0 }
+        self.__transport = None
+
+    def connection_made(self, transport):
+        self.__transport = transport
+
+    #  (☞ﾟヮﾟ)☞  Find the parameter and patchboard of a binding name
+    #  Bindings for a multi-timbral channel have the format channel:class_name.member_name
+    def __find_target(self, name):
+        if name in self.__targets: return self.__targets[name]
+        if name in self.__GLOBALS: target = [ self.__GLOBALS[name], None, None ]
+        else:
+            channel, _, binding = name.rpartition(":")
+            try:
+                if channel: patches = self.__channel_map[int(channel) - 1][1]
+                else: patches = self.__patches
+                #  Make sure the module is loaded
+                patches.get_module(binding.split(".", 1)[0])
+            except (IndexError, KeyError, ValueError):
+                return None
+            target = [ name, patches, binding ]
+        self.__targets[name] = target
+        return target
+
+    #  Set a batch of parameters at once
+    def __flush(self, batch):
+        if not batch: return
+        try:
+            self.__params.set_many(batch)
+            self.__stats['params'] += len(batch)
+        except IndexError:
+            self.__stats['errors'] += len(batch)  #  If the store is full, do nothing
+        batch.clear()
+
+    #  Reply with the message counts and audio status
+    def __send_stats(self, addr):
+        stats = []
+        for name, value in self.__stats.items(): stats += [ name, value ]
+        stats += [
+            'blocksize', self.__tuner.get_blocksize() or 0,
+            'latency', float(self.__tuner.get_latency() or 0),
+            'load', float(self.__tuner.get_load()),
+            'recording', self.__rec.is_recording(),
+            'dropped', self.__rec.get_dropped()
+        ]
+        self.__transport.sendto(osc_codec.message("/ppms/stats", *stats), addr)
+
+    #  ᕕ(⌐■_■)ᕗ ♪♬  Handle a packet
+    #  All parameters in a packet are set together
+    def datagram_received(self, data, addr):
+        try: messages = osc_codec.parse(data)
+        except ValueError:
+            self.__stats['errors'] += 1
+            return
+        batch = []
+        for address, args in messages:
+            self.__stats['messages'] += 1
+            if(self.__verbose): print("[OSC %s:%d] %s %r" % (addr[0], addr[1], address, args))
+            #  Arguments are pairs of binding name and value
+            if address == "/ppms/param":
+                if len(args) % 2: self.__stats['errors'] += 1
+                for name, value in zip(args[0::2], args[1::2]):
+                    target = self.__find_target(name) if isinstance(name, str) else None
+                    if(target is None or isinstance(value, (bool, str))
+                    or not math.isfinite(value)):
+                        self.__stats['errors'] += 1
+                        continue
+                    #  Clamp to the range a MIDI message could have sent
+                    limit = self.__MAX_BEND if target[0] == 'pitch_bend' else self.__MAX_VALUE
+                    batch.append([ target[0], min(max(value, 0), limit), target[1], target[2] ])
+            elif address == "/ppms/preset":
+                #  Parameters sent before the preset are set first
+                self.__flush(batch)
+                if(len(args) == 1 and isinstance(args[0], int) and not isinstance(args[0], bool)
+                and load_preset(self.__settings, self.__patches, self.__params, self.__presets, args[0])):
+                    self.__stats['presets'] += 1
+                else: self.__stats['errors'] += 1
+            elif address == "/ppms/stats": self.__send_stats(addr)
+            else: self.__stats['errors'] += 1
+        self.__flush(batch)
+
+##################################################################
+#  OSC coroutine
+#  Opens the OSC control endpoint on localhost then sleeps until exit
+##################################################################
+async def ppms_osc(exit_event, settings, patches, channel_map, params, presets, rec, tuner, verbose):
+    if settings['osc_port'] is None: return
+    try:
+        transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: osc_control(settings, patches, channel_map, params, presets, rec, tuner, verbose),
+            local_addr=("127.0.0.1", settings['osc_port'])
         )
-    #  Run until exit event
-    with stream: await exit_event.wait()
+    except OSError as e:
+        #  Report error and continue without OSC
+        print("Error opening OSC port: ", e)
+        return
+    print(f"OSC control listening on 127.0.0.1:{settings['osc_port']}")
+    await exit_event.wait()
+    transport.close()
 
 ##################################################################
 #  Control coroutine
@@ -325,21 +906,25 @@ async def ppms_output(exit_event, device, settings, patches, note_queue, osc):
 #  Sends exit event when keyboard interrupt detected
 ##################################################################
 async def ppms_control(exit_event, gate, note_queue, patches):
-    while True:
-        #  Check for a gate signal
-        gate_signal = None
+    loop = asyncio.get_running_loop()
+    #  Control-C sets the exit event, so every coroutine stops and settings are saved
+    #  Set here so it's after the MIDI port prompt of the input coroutine
+    try: loop.add_signal_handler(signal.SIGINT, exit_event.set)
+    except NotImplementedError: pass  #  Not on this platform, KeyboardInterrupt is caught below
+    while not exit_event.is_set():
         try:
-            #  Get gate signal from input
-            gate_signal = gate.get(block=True, timeout=0.01)
+            #  Wait for a gate signal in a worker thread, so the other coroutines keep running
+            gate_signal = await loop.run_in_executor(None, gate.get, True, 0.1)
             #  Send gate signal to output
             note_queue.put(gate_signal)
             #  Done
             gate.task_done()
+        except queue.Empty:
+            pass
         except KeyboardInterrupt:
             break
-        except:
-            pass
-    #  End while True
+    try: loop.remove_signal_handler(signal.SIGINT)
+    except NotImplementedError: pass
 
     #  While loop broken, send exit event
     exit_event.set()
@@ -347,16 +932,64 @@ async def ppms_control(exit_event, gate, note_queue, patches):
 ##################################################################
 #  Main function, starts coroutines
 ##################################################################
-async def main(settings, port, device, noimpact, verbose):
+async def main(settings, port, device, noimpact, verbose, record, record_mmap, profile, autotune):
+    import sounddevice as sd
+
     #  Create the synth objects
     osc = oscillator(settings['sample_rate'])
-    patches = patchboard()
+    try:
+        tune = tuning(settings['bend_range'], settings['tuning_file'])
+    except (IOError, ValueError):
+        print("Error loading tuning file: ", settings['tuning_file'])
+        tune = tuning(settings['bend_range'])
+    samp = sampler(settings['sample_rate'], tune)
+    try:
+        samp.load_zones(settings['sampler_zones'])
+    except (IOError, IndexError, TypeError, ValueError) as e:
+        #  Report error and continue without samples
+        print("Error loading sampler zones: ", e)
+        samp.load_zones([])
+    patches = patchboard(settings['voices'])
+    channel_map = load_channels(settings)
     gate = queue.Queue()
     note_queue = queue.Queue()
+    mods = modulator(settings['sample_rate'])
+    rec = recorder(settings['sample_rate'], use_mmap=record_mmap)
+    prof = profiler(profile is not None)
+    if prof.is_enabled():
+        patches.set_profiler(prof)
+        for channel in channel_map.values(): channel[1].set_profiler(prof)
+    presets = preset_bank()
+
+    #  Open the preset bank, otherwise presets are read from their files
+    try:
+        presets.open(os.path.join(settings['preset_folder'], settings['preset_bank']))
+        print("Preset bank loaded!")
+    except (IOError, ValueError):
+        print("Preset bank not found, using preset files...")
+
+    #  Pitch wheel springs back to center, so always start there
+    settings['pitch_bend'] = tuning.BEND_CENTER
+    params = create_params(settings)
 
     #  Load data
     load_ppms_modules(settings, patches)
     load_module_data(settings, patches)
+    try:
+        mods.load(settings['mod_sources'], settings['mod_matrix'])
+    except (IndexError, TypeError, ValueError):
+        #  Report error and continue without modulation
+        print("Error loading modulation settings!")
+        mods.load([], [])
+
+    #  Use the block size and latency saved for this output device
+    device_name = sd.query_devices(device, 'output')['name']
+    saved = settings['audio_tuning'].get(device_name, {})
+    tuner = block_tuner(settings['sample_rate'], autotune, saved.get('blocksize'), saved.get('latency'))
+    if autotune:
+        print("Measuring block size...")
+        blocksize = autotune_blocksize(settings, tuner, osc, samp, tune)
+        print(f"Block size set to {blocksize}")
 
     #  Event object for exiting program
     exit_event = asyncio.Event()
@@ -364,20 +997,52 @@ async def main(settings, port, device, noimpact, verbose):
     #  Create coro tasks
     in_task = asyncio.create_task(
         ppms_input(
-            exit_event, settings, patches, gate,
+            exit_event, settings, patches, channel_map, params, presets, gate, rec, tuner,
             port, noimpact, verbose
         )
     )
     out_task = asyncio.create_task(
-        ppms_output(exit_event, device, settings, patches, note_queue, osc)
+        ppms_output(
+            exit_event, device, settings, patches, channel_map, params, note_queue,
+            osc, samp, tune, mods, rec, prof, tuner
+        )
     )
     control_task = asyncio.create_task(
         ppms_control(exit_event, gate, note_queue, patches)
     )
+    osc_task = asyncio.create_task(
+        ppms_osc(exit_event, settings, patches, channel_map, params, presets, rec, tuner, verbose)
+    )
+
+    #  Start recording right away if a file was given
+    if record is not None: toggle_recording(settings, rec, record)
 
     await in_task
     await out_task
     await control_task
+    await osc_task
+
+    #  Finish any recording still running
+    if rec.is_recording(): toggle_recording(settings, rec)
+    rec.wait()
+    presets.close()
+
+    #  Copy the shared variables back for saving
+    for name in [ 'master_volume', 'pitch_bend', 'mod_value' ]: settings[name] = params.get(name)
+
+    #  Save the tuned block size and latency for this output device
+    if autotune:
+        settings['audio_tuning'][device_name] = {
+            'blocksize': tuner.get_blocksize(), 'latency': tuner.get_latency()
+        }
+
+    #  Save profile timings
+    if prof.is_enabled():
+        try:
+            prof.write(profile)
+            print("Profile saved: ", profile)
+        except IOError:
+            print("Error saving profile: ", profile)
 
 ##################################################################
 #  Start program
@@ -407,13 +1072,33 @@ if __name__ == "__main__":
         "-c", "--config", dest="config", default="settings.json",
         metavar="file", type=str, help="Configuration file to load. Default: %(default)s"
     )
+    parser.add_argument(
+        "-r", "--record", dest="record", default=None,
+        metavar="file", type=str, help="Record output to a .wav or raw float32 file."
+    )
+    parser.add_argument(
+        "--record_mmap", dest="record_mmap", default=False,
+        action="store_true", help="Write recordings through a memory mapped file."
+    )
+    parser.add_argument(
+        "--profile", dest="profile", default=None, nargs="?", const="ppms.folded",
+        metavar="file", type=str, help="Time the audio output and save folded stacks on exit. Default: %(const)s"
+    )
+    parser.add_argument(
+        "--autotune", dest="autotune", default=False,
+        action="store_true", help="Pick the block size and adapt the latency to the load."
+    )
     parser.add_argument(
         "--noimpact", dest="noimpact", default=False,
         action="store_true", help="Disable keyboard impact."
     )
     parser.add_argument(
         "--build_presets", dest="build_presets", default=False,
-        action="store_true", help="Detect presets."
+        action="store_true", help="Detect presets and compile the preset bank."
+    )
+    parser.add_argument(
+        "--export_presets", dest="export_presets", default=None,
+        metavar="folder", type=str, help="Export the preset bank to preset files and exit."
     )
     parser.add_argument(
         "--list_audio", dest="list_audio", default=False,
@@ -429,16 +1114,16 @@ if __name__ == "__main__":
     if(args.set_defaults):
         settings = create_default_settings()
         try:
-            with open("settings.json", "w") as json_file:
-                json.dump(settings, json_file, indent=4)
-                print("Default settings.json created.  Exiting...")
-                sys.exit(0)
+            save_json("settings.json", settings)
+            print("Default settings.json created.  Exiting...")
+            sys.exit(0)
         except IOError:
             print("Error creating settings.json!  Exiting...")
             sys.exit(1)
 
     #  If --list_audio passed, show available audio devices and exit
     if(args.list_audio):
+        import sounddevice as sd
         print(sd.query_devices())
         sys.exit(0)
 
@@ -459,12 +1144,30 @@ if __name__ == "__main__":
         print("Error loading settings!  Exiting...")
         sys.exit(1)
 
+    #  Fill in any settings missing from older configuration files
+    for key, value in create_default_settings().items():
+        settings.setdefault(key, value)
+
     #  If --build_presets was passed, load preset files into settings
     if(args.build_presets):
         print("Building preset list...")
         settings['presets'] = [f for f in os.listdir(settings['preset_folder'] + "/") if f.endswith(".json")]
+        try:
+            build_preset_bank(settings)
+        except (IOError, ValueError) as e:
+            print("Error building preset bank: ", e)
         print("Done!")
 
+    #  If --export_presets was passed, write the preset bank to files then exit
+    if(args.export_presets is not None):
+        try:
+            export_preset_bank(settings, args.export_presets)
+            print("Presets exported.  Exiting...")
+            sys.exit(0)
+        except (IOError, ValueError):
+            print("Error exporting presets!  Exiting...")
+            sys.exit(1)
+
     #  Check if MIDI port or Output Device is configured in settings
     #  Command line arguments will override
     try:
@@ -479,13 +1182,15 @@ if __name__ == "__main__":
         pass
 
     #  Now run the main program
-    asyncio.run(main(settings, args.port, args.device, args.noimpact, args.verbose), debug=False)
+    asyncio.run(main(
+        settings, args.port, args.device, args.noimpact, args.verbose,
+        args.record, args.record_mmap, args.profile, args.autotune
+    ), debug=False)
 
     #  Wrap up by saving the settings
     try:
-        with open(args.config, "w") as json_file:
-            json.dump(settings, json_file, indent=4)
-            print("Settings saved!  Exiting...")
+        save_json(args.config, settings)
+        print("Settings saved!  Exiting...")
     except IOError:
         print("Error saving settings.json!  Exiting...")
         sys.exit(1)
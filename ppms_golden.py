@@ -0,0 +1,173 @@
+##################################################################
+#
+#  Python Polyphonic MIDI Synthesizer
+#
+##################################################################
+#
+#               ~~~~~~~[]=¤ԅ(ˊᗜˋ* )੭
+#
+#  Filename:  ppms_golden.py
+#  By:  Matthew Evans
+#       https://www.wtfsystems.net/
+#
+#  See LICENSE.md for copyright information.
+#  See README.md for usage information.
+#
+#  Renders MIDI scripts without any audio or MIDI devices and
+#  compares the output against stored golden renders
+#
+##################################################################
+
+import os, sys, time, json, glob, queue, argparse
+
+import numpy as np
+
+from ppms import create_default_settings, load_ppms_modules, load_module_data, load_channels, create_params
+from ppms import midi_input_handler, create_audio_callback
+from mod.parts import tuning, oscillator, sampler, patchboard, mod_control, modulator
+from mod.parts import recorder, preset_bank, profiler
+
+##################################################################
+#  Function to render a MIDI script
+#  Returns the rendered signal and the time taken in seconds
+##################################################################
+def render_script(script):
+    settings = create_default_settings()
+    settings.update(script.get('settings', {}))
+    frame_size = script.get('frame_size', 512)
+    blocks = script['blocks']
+
+    #  Reload modules so settings from an earlier script don't carry over
+    for channel in [ settings ] + settings['channels']:
+        for module in channel['modules']: sys.modules.pop(module, None)
+    mod_control.set_mod_value(0)
+
+    #  Build the pipeline the same way as ppms
+    osc = oscillator(settings['sample_rate'])
+    tune = tuning(settings['bend_range'], settings['tuning_file'])
+    samp = sampler(settings['sample_rate'], tune)
+    samp.load_zones(settings['sampler_zones'])
+    patches = patchboard(settings['voices'])
+    load_ppms_modules(settings, patches)
+    load_module_data(settings, patches)
+    channel_map = load_channels(settings)
+    mods = modulator(settings['sample_rate'])
+    mods.load(settings['mod_sources'], settings['mod_matrix'])
+    params = create_params(settings)
+    rec = recorder(settings['sample_rate'], buffer_seconds=1)
+    gate = queue.Queue()
+    note_queue = queue.Queue()
+    handler = midi_input_handler(
+        settings, patches, channel_map, params, preset_bank(), gate, rec,
+        "golden", script.get('noimpact', False), False
+    )
+    audio_callback = create_audio_callback(
+        settings, patches, channel_map, params, note_queue, osc, samp, tune, mods, rec, profiler(False)
+    )
+
+    #  Events have the format block, midi_message
+    #  The events of each block are handled as one batch, and controllers
+    #  are combined over the block, the same as ppms
+    events = sorted(script['events'], key=lambda event: event[0])
+    output = np.zeros(shape=(blocks * frame_size, 1), dtype=np.float32)
+    start = time.perf_counter()
+    for block in range(blocks):
+        batch = []
+        while events and events[0][0] <= block: batch.append((events.pop(0)[1], 0.0))
+        if batch: handler.handle_batch(batch)
+        handler.flush_controls()
+        while not gate.empty(): note_queue.put(gate.get_nowait())
+        audio_callback(output[block * frame_size:(block + 1) * frame_size], frame_size, None, None)
+    return output, time.perf_counter() - start
+
+##################################################################
+#  Function to compare a render against its golden render
+#  Returns the largest sample error and the spectral error in dB
+##################################################################
+def compare_render(output, golden):
+    if output.shape != golden.shape: return float("inf"), float("inf")
+    max_error = float(np.max(np.abs(output - golden)))
+    #  Difference of the magnitude spectra relative to the golden spectrum
+    output_spectrum = np.abs(np.fft.rfft(output[:, 0]))
+    golden_spectrum = np.abs(np.fft.rfft(golden[:, 0]))
+    difference = np.linalg.norm(output_spectrum - golden_spectrum)
+    reference = max(np.linalg.norm(golden_spectrum), np.finfo(np.float32).tiny)
+    spectral_error = 20 * np.log10(max(difference / reference, 1e-12))
+    return max_error, float(spectral_error)
+
+##################################################################
+#  Start program
+##################################################################
+if __name__ == "__main__":
+    #  Parse arguments
+    parser = argparse.ArgumentParser(description="Compare renders against golden output.")
+    parser.add_argument(
+        "scripts", nargs="*", metavar="script",
+        help="MIDI scripts to render. Default: all scripts in golden/scripts"
+    )
+    parser.add_argument(
+        "-u", "--update", dest="update", default=False,
+        action="store_true", help="Save the renders as the new golden output."
+    )
+    parser.add_argument(
+        "-t", "--tolerance", dest="tolerance", default=1e-5,
+        metavar="#", type=float, help="Largest allowed sample error. Default: %(default)s"
+    )
+    parser.add_argument(
+        "-s", "--spectral", dest="spectral", default=None,
+        metavar="dB", type=float, help="Compare by spectral error in dB instead of sample error."
+    )
+    parser.add_argument(
+        "-r", "--report", dest="report", default=None,
+        metavar="file", type=str, help="Save the results and render times to a JSON file."
+    )
+    args = parser.parse_args()
+
+    #  Paths in the scripts are relative to the ppms folder
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    if not args.scripts: args.scripts = sorted(glob.glob(os.path.join("golden", "scripts", "*.json")))
+
+    results = []
+    failed = False
+    for script_name in args.scripts:
+        name = os.path.splitext(os.path.basename(script_name))[0]
+        golden_name = os.path.join("golden", name + ".npy")
+        with open(script_name, "r") as json_file:
+            script = json.load(json_file)
+        output, elapsed = render_script(script)
+        rate = script.get('settings', {}).get('sample_rate', create_default_settings()['sample_rate'])
+        result = {
+            'script': name,
+            'render_time': elapsed,
+            'realtime': (output.shape[0] / rate) / max(elapsed, 1e-9)
+        }
+
+        if args.update:
+            np.save(golden_name, output)
+            result['status'] = "UPDATED"
+        else:
+            try:
+                golden = np.load(golden_name)
+                result['max_error'], result['spectral_error'] = compare_render(output, golden)
+                if args.spectral is not None: passed = result['spectral_error'] <= args.spectral
+                else: passed = result['max_error'] <= args.tolerance
+                result['status'] = "PASS" if passed else "FAIL"
+            except IOError:
+                result['status'] = "MISSING"
+            if result['status'] != "PASS": failed = True
+
+        line = f"{result['status']:8} {name:24} {elapsed * 1000:9.2f} ms {result['realtime']:8.1f}x realtime"
+        if 'max_error' in result:
+            line += f"  max error {result['max_error']:.3g}  spectral {result['spectral_error']:.1f} dB"
+        print(line)
+        results.append(result)
+
+    if args.report is not None:
+        with open(args.report, "w") as json_file:
+            json.dump(results, json_file, indent=4)
+
+    if failed:
+        print("Golden output check failed.  Run with --update to accept new output.")
+        sys.exit(1)
+
+#  EOF
@@ -0,0 +1,132 @@
+##################################################################
+#
+#  Python Polyphonic MIDI Synthesizer
+#
+##################################################################
+#
+#               ~~~~~~~[]=¤ԅ(ˊᗜˋ* )੭
+#
+#  Filename:  ppms_osc.py
+#  By:  Matthew Evans
+#       https://www.wtfsystems.net/
+#
+#  See LICENSE.md for copyright information.
+#  See README.md for usage information.
+#
+#  Test client for the OSC control endpoint.  Sets parameters,
+#  loads presets and shows the stats of a running ppms
+#
+##################################################################
+
+import sys, time, socket, argparse
+
+from mod.parts import osc_codec
+
+##################################################################
+#  Function to read a value from the command line
+#  Whole numbers are sent as ints, everything else as floats
+##################################################################
+def parse_value(text):
+    try: return int(text)
+    except ValueError: return float(text)
+
+##################################################################
+#  Function to send parameters
+#  Each bundle is set by ppms all at once
+##################################################################
+def send_params(sock, addr, params, batch_size):
+    for pos in range(0, len(params), batch_size):
+        sock.sendto(osc_codec.bundle([
+            osc_codec.message("/ppms/param", name, value) for name, value in params[pos:pos + batch_size]
+        ]), addr)
+
+##################################################################
+#  Function to ask for the stats
+#  Returns a dictionary of the stats, or None if there was no reply
+##################################################################
+def query_stats(sock, addr, timeout):
+    sock.sendto(osc_codec.message("/ppms/stats"), addr)
+    sock.settimeout(timeout)
+    try:
+        data, _ = sock.recvfrom(65536)
+    except socket.timeout:
+        return None
+    for address, args in osc_codec.parse(data):
+        if address == "/ppms/stats": return dict(zip(args[0::2], args[1::2]))
+    return None
+
+##################################################################
+#  Start program
+##################################################################
+if __name__ == "__main__":
+    #  Parse arguments
+    parser = argparse.ArgumentParser(description="Send OSC control messages to ppms.")
+    parser.add_argument(
+        "--port", dest="port", default=9000,
+        metavar="#", type=int, help="OSC port of ppms. Default: %(default)s"
+    )
+    parser.add_argument(
+        "--param", dest="params", default=[], nargs=2, action="append",
+        metavar=("binding", "value"), help="Set a parameter by binding name.  Can be used more than once."
+    )
+    parser.add_argument(
+        "--preset", dest="preset", default=None,
+        metavar="#", type=int, help="Load a preset by number."
+    )
+    parser.add_argument(
+        "--stats", dest="stats", default=False,
+        action="store_true", help="Display the stats of ppms."
+    )
+    parser.add_argument(
+        "--bench", dest="bench", default=None,
+        metavar="#", type=int, help="Send a number of parameter updates and display the rate."
+    )
+    parser.add_argument(
+        "--bench_binding", dest="bench_binding", default="mod_wheel",
+        metavar="binding", type=str, help="Binding to update when benchmarking. Default: %(default)s"
+    )
+    parser.add_argument(
+        "--batch", dest="batch", default=64,
+        metavar="#", type=int, help="Parameters to send in each bundle. Default: %(default)s"
+    )
+    args = parser.parse_args()
+
+    #  Only send to ppms on this machine
+    addr = ("127.0.0.1", args.port)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    if args.params:
+        send_params(sock, addr, [ [ name, parse_value(value) ] for name, value in args.params ], args.batch)
+        print(f"Sent {len(args.params)} parameters.")
+
+    if args.preset is not None:
+        sock.sendto(osc_codec.message("/ppms/preset", args.preset), addr)
+        print(f"Sent preset {args.preset}.")
+
+    if args.bench is not None:
+        before = query_stats(sock, addr, 1.0)
+        if before is None:
+            print("No reply from ppms.  Exiting...")
+            sys.exit(1)
+        start = time.perf_counter()
+        send_params(sock, addr, [ [ args.bench_binding, count % 128 ] for count in range(args.bench) ], args.batch)
+        elapsed = time.perf_counter() - start
+        after = query_stats(sock, addr, 1.0)
+        if after is None:
+            print("No reply from ppms.  Exiting...")
+            sys.exit(1)
+        received = after['params'] - before['params']
+        print(f"Sent {args.bench} updates in {elapsed * 1000:.1f} ms  ({args.bench / max(elapsed, 1e-9):.0f} per second)")
+        print(f"Set {received} parameters, {after['errors'] - before['errors']} errors")
+        print(f"Output load {after['load']:.2f}, {after['dropped']} recorded frames dropped")
+
+    if args.stats:
+        stats = query_stats(sock, addr, 1.0)
+        if stats is None:
+            print("No reply from ppms.  Exiting...")
+            sys.exit(1)
+        for name, value in stats.items(): print(f"{name:12} {value}")
+
+    sock.close()
+
+#  EOF